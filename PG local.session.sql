@@ -4,3 +4,6 @@ CREATE TABLE evidence_metadata (
     evidence_id VARCHAR(100) NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- deepfake results (deepfake/evidence.py), frame_scores : float16 per sampled frame
+ALTER TABLE evidence_metadata ADD COLUMN IF NOT EXISTS frame_scores BYTEA;
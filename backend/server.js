@@ -89,7 +89,8 @@ app.post("/upload", upload.single("video"), async (req, res) => {
     const pythonExe = "python";
     const scriptPath = path.join(__dirname, "..", "insert.py");
     const quoted = (s) => `"${s.replace(/"/g, '\\"')}"`;
-    const cmd = `${quoted(pythonExe)} ${quoted(scriptPath)} ${quoted(caseId)} ${quoted(evidenceId)} ${quoted(videoPath)}`;
+    // pass the hash along so insert.py does not read the video again
+    const cmd = `${quoted(pythonExe)} ${quoted(scriptPath)} ${quoted(caseId)} ${quoted(evidenceId)} ${quoted(videoPath)} ${quoted(videoHash)}`;
 
     console.log("Executing upload command:", cmd);
 
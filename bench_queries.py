@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the login and inserttransactiondata queries
+
+Compares the old path (new connection per request, statement text built with
+% formatting and parsed by the server each time) against queries.Database
+(pooled connection, prepared handle reused). Needs the forenics database from
+database.sql and at least one row in users. The inserted transactiondata rows
+are rolled back.
+
+usage: python bench_queries.py [iterations]
+"""
+
+import sys
+import time
+
+import mysql.connector
+
+import queries
+
+
+def timed(label, n, func):
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f" {label:<34}: {elapsed / n * 1e6:9.1f} us/query")
+
+
+def main(n):
+    with queries.Database() as db:
+        user = db.fetchone("select uid, password from users order by uid limit 1")
+    if user is None:
+        raise Exception("users table is empty")
+    uid, password = user
+
+    # ---------------- LOGIN ---------------- #
+
+    def old_login(i):
+        mydb = mysql.connector.connect(**queries.DB_CONFIG)
+        mycursor = mydb.cursor()
+        mycursor.execute("select *   from users where uid='%s' and password='%s'" % (uid, password))
+        mycursor.fetchone()
+        mydb.close()
+
+    text = mysql.connector.connect(**queries.DB_CONFIG)
+
+    def text_login(i):
+        mycursor = text.cursor()
+        mycursor.execute("select *   from users where uid='%s' and password='%s'" % (uid, password))
+        mycursor.fetchall()
+        mycursor.close()
+
+    def prepared_login(i):
+        with queries.Database() as db:
+            db.fetchone(queries.LOGIN, (uid, password))
+
+    print("========== LOGIN ==========")
+    timed("connect + text protocol (old)", n, old_login)
+    timed("one connection, text protocol", n, text_login)
+    timed("pooled, prepared handle", n, prepared_login)
+
+    # ---------- INSERTTRANSACTIONDATA ---------- #
+
+    row = ("bench", uid, 0, "bench", "bench", "2024-01-01 00:00:00")
+
+    def text_insert(i):
+        mycursor = text.cursor()
+        mycursor.execute("insert into transactiondata(trandata,uid,did,transcation,alltrans,trandate)values ('%s','%s','%s','%s','%s','%s')" % row)
+        mycursor.close()
+
+    db = queries.Database()
+
+    def prepared_insert(i):
+        db.execute(queries.INSERT_TRANSACTIONDATA, row)
+
+    print("===== INSERTTRANSACTIONDATA =====")
+    timed("one connection, text protocol", n, text_insert)
+    text.rollback()
+    timed("pooled, prepared handle", n, prepared_insert)
+    db.rollback()
+    db.close()
+    text.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
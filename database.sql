@@ -1,6 +1,29 @@
-create table users(uid int primary key,name varchar(1000)
+create table users(uid int auto_increment primary key,name varchar(1000)
 ,email varchar(100) unique,password varchar(100),addresss varchar(1000),
 keydata varchar(1000));
-create table data(did int primary key,filename varchar(100),codeid text); 
-create table transactiondata(td int primary key,trandata text,uid int,
-did int,transcation varchar(100),alltrans text,trandate datetime default current_timestamp);
\ No newline at end of file
+create table data(did int auto_increment primary key,filename varchar(100),codeid text,
+keyvalue varchar(100),caseid varchar(100)); 
+create table transactiondata(td int auto_increment primary key,trandata text,uid int,
+did int,transcation varchar(100),alltrans text,trandate datetime default current_timestamp);
+
+-- listing filters page on the primary key (where ... and id > after_id order by id)
+create index data_caseid on data(caseid,did);
+create index transactiondata_uid on transactiondata(uid,td);
+create index transactiondata_did on transactiondata(did,td);
+create index transactiondata_trandate on transactiondata(trandate);
+
+-- migration for databases created before ids were auto-assigned
+-- (ids used to be allocated in update.py with select max + 1)
+-- alter table users modify uid int not null auto_increment;
+-- alter table data modify did int not null auto_increment;
+-- alter table transactiondata modify td int not null auto_increment;
+-- alter table data add column keyvalue varchar(100), add column caseid varchar(100);
+
+-- background upload jobs (see jobs.py)
+create table jobs(jid int auto_increment primary key,status varchar(20),stage varchar(20),
+filename varchar(100),caseid varchar(100),uid int,did int,error text,owner varchar(100),
+created datetime default current_timestamp,
+updated datetime default current_timestamp on update current_timestamp);
+create index jobs_status on jobs(status);
+-- migration for jobs tables created before jobs recorded their process
+-- alter table jobs add column owner varchar(100);
@@ -1,6 +1,4 @@
 import streamlit as st
-import cv2
-import numpy as np
 import tempfile
 import os
 
@@ -19,7 +17,11 @@ sys.modules['keras.layers'].LeakyReLU = FixedLeakyReLU
 sys.modules['tensorflow.keras.layers'].LeakyReLU = FixedLeakyReLU
 
 
-from classifiers import Meso4
+from classifiers import Meso4, load_classifier
+from engine import VideoAnalysisEngine
+from hashing import save_stream
+from sampling import FrameSampler
+from scoring import SequentialTest
 
 # Get the directory of the current script
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -33,9 +35,7 @@ st.write("Upload a video and check whether it is REAL or FAKE")
 # Load the model and cache it for faster reloads
 @st.cache_resource
 def load_model():
-    model = Meso4()
-    model.load(WEIGHTS_PATH)
-    return model
+    return load_classifier(Meso4, WEIGHTS_PATH)
 
 model = load_model()
 
@@ -43,52 +43,43 @@ model = load_model()
 uploaded_video = st.file_uploader("Upload a video file", type=["mp4", "avi", "mov"])
 
 if uploaded_video:
-    tfile = tempfile.NamedTemporaryFile(delete=False)
-    tfile.write(uploaded_video.read())
-    
     # Show uploaded video in Streamlit
-    st.video(tfile.name)
+    st.video(uploaded_video)
+
+    early_stop = st.checkbox("Stop as soon as the verdict is settled")
 
     # Run Deepfake Detection
     if st.button("Run Deepfake Detection"):
-        cap = cv2.VideoCapture(tfile.name)
-        fake_scores = []
-        frame_count = 0
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
         progress_bar = st.progress(0)
         status_text = st.empty()
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            
-            # Process every 10th frame for speed
-            if frame_count % 10 == 0:
-                frame_resized = cv2.resize(frame, (256, 256))
-                frame_normalized = frame_resized / 255.0
-                frame_input = np.expand_dims(frame_normalized, axis=0)
-                
-                # Predict
-                pred = model.model.predict(frame_input, verbose=0)[0][0]
-                fake_scores.append(pred)
-
-            frame_count += 1
-
-            # Update progress
+        def show_progress(frame_count, total_frames):
             if total_frames > 0:
                 progress_bar.progress(min(frame_count / total_frames, 1.0))
                 status_text.text(f"Processing frame {frame_count} / {total_frames}")
 
-        cap.release()
+        # The temporary copy only lives for the analysis
+        fd, video_path = tempfile.mkstemp(suffix=os.path.splitext(uploaded_video.name)[1])
+        os.close(fd)
+        try:
+            # Copied in chunks rather than as one bytes object
+            uploaded_video.seek(0)
+            save_stream(uploaded_video, video_path)
+            # Every 10th frame, predicted in batches
+            engine = VideoAnalysisEngine(model, sampler=FrameSampler('every_nth', step=10))
+            result = engine.analyse(video_path, progress=show_progress,
+                                    early_stop=SequentialTest() if early_stop else None)
+        finally:
+            os.unlink(video_path)
 
         # Compute average fake probability
-        if fake_scores:
-            avg_fake = sum(fake_scores) / len(fake_scores)
+        if result['scores']:
+            avg_fake = result['avg_probability']
             st.subheader("📊 Result")
             st.write(f"Average Fake Probability: **{avg_fake:.2f}**")
+            st.write(f"Frames analysed: **{result['frames_used']}**")
+            if result['stopped_early']:
+                st.write(f"Stopped early with **{result['confidence']:.1%}** confidence")
             if avg_fake > 0.5:
                 st.error("❌ FAKE VIDEO DETECTED")
             else:
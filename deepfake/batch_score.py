@@ -0,0 +1,151 @@
+# -*- coding:utf-8 -*-
+'''
+Scores every video of a directory with a process pool, for triaging seized
+devices with many clips.
+
+    python batch_score.py VIDEO_DIR results.jsonl [--workers 4] [--weights weights/Meso4_DF.h5]
+
+Each worker loads the classifier once. Results are appended to the JSON-lines
+file as videos finish, one object per video. Running the same command again
+skips the videos already in the file, so an interrupted run resumes where it
+stopped (videos that failed are retried).
+
+With --evidence, videos named <case id>_<evidence id>.<ext> (the backend
+uploads directory) also get their verdict written to evidence_metadata, in
+batches of --db-batch results.
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+WEIGHTS = 'weights/Meso4_DF.h5'
+DB_BATCH = 100
+
+# the classifier of the current worker process
+_classifier = None
+
+
+def init_worker(classifier_name, weights):
+    global _classifier
+    from classifiers import load_classifier
+    _classifier = load_classifier(classifier_name, weights)
+
+
+def score(path, frame_subsample_count, cache_dir, detector):
+    ''' Runs in a worker : face extraction + prediction of one video '''
+    from pipeline import predict_video
+    from sampling import FrameSampler
+
+    start = time.perf_counter()
+    sampler = FrameSampler('uniform', count = frame_subsample_count)
+    p = predict_video(_classifier, path, sampler, cache_dir, detector)
+    p = np.asarray(p).reshape(-1)
+    return {
+        'video': os.path.basename(path),
+        'path': path,
+        'faces': int(len(p)),
+        'fake_ratio': float(np.mean(p > 0.5)) if len(p) else None,
+        'avg_probability': float(np.mean(p)) if len(p) else None,
+        'predictions': p.tolist(),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def completed(results_file):
+    ''' Videos with a result in an existing results file '''
+    done = set()
+    if os.path.exists(results_file):
+        with open(results_file) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # line cut short by an interruption
+                if 'error' not in result:
+                    done.add(result['path'])
+    return done
+
+
+def evidence_result(result, frame_scores = False):
+    ''' evidence_metadata row of a result, None if the file name is not <case id>_<evidence id>.<ext> '''
+    case_id, sep, evidence_id = os.path.splitext(result['video'])[0].partition('_')
+    if not sep or result.get('avg_probability') is None:
+        return None
+    return {
+        'case_id': case_id,
+        'evidence_id': evidence_id,
+        'avg_probability': result['avg_probability'],
+        'prediction': 'FAKE' if result['avg_probability'] > 0.5 else 'REAL',
+        'frame_scores': result['predictions'] if frame_scores else None,
+    }
+
+
+def write_evidence(rows):
+    from evidence import update_results
+    updated = update_results(rows)
+    print('evidence_metadata :', len(updated), 'of', len(rows), 'rows updated')
+
+
+def batch_score(dirname, results_file, workers = None, classifier_name = 'Meso4', weights = WEIGHTS,
+                frame_subsample_count = 30, cache_dir = None, detector = None,
+                evidence = False, frame_scores = False, db_batch = DB_BATCH):
+    from pipeline import list_videos
+
+    done = completed(results_file)
+    paths = [os.path.join(dirname, f) for f in list_videos(dirname)]
+    todo = [path for path in paths if path not in done]
+    print('Batch scoring :', len(todo), 'videos to score,', len(paths) - len(todo), 'already done')
+
+    # spawn : forking a process that has TensorFlow loaded can deadlock
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = workers, mp_context = context,
+                             initializer = init_worker, initargs = (classifier_name, weights)) as pool, \
+            open(results_file, 'a') as out:
+        futures = {pool.submit(score, path, frame_subsample_count, cache_dir, detector): path for path in todo}
+        pending = []
+        for n, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'video': os.path.basename(path), 'path': path, 'error': str(e)}
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            print('[{}/{}]'.format(n, len(todo)), result['video'], result.get('fake_ratio', result.get('error')))
+
+            row = evidence_result(result, frame_scores) if evidence else None
+            if row is not None:
+                pending.append(row)
+                if len(pending) >= db_batch:
+                    write_evidence(pending)
+                    pending = []
+        if pending:
+            write_evidence(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dirname')
+    parser.add_argument('results_file')
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    parser.add_argument('--classifier', default = 'Meso4', choices = ['Meso4', 'MesoInception4'])
+    parser.add_argument('--weights', default = WEIGHTS)
+    parser.add_argument('--frames', type = int, default = 30, help = 'frames analysed per video')
+    parser.add_argument('--cache-dir', help = 'keep face detections between runs')
+    parser.add_argument('--detector', choices = ['cnn', 'hog', 'haar'])
+    parser.add_argument('--evidence', action = 'store_true', help = 'write verdicts to evidence_metadata')
+    parser.add_argument('--frame-scores', action = 'store_true', help = 'with --evidence, store the per-frame scores too')
+    parser.add_argument('--db-batch', type = int, default = DB_BATCH)
+    args = parser.parse_args()
+    batch_score(args.dirname, args.results_file, args.workers, args.classifier, args.weights,
+                args.frames, args.cache_dir, args.detector, args.evidence, args.frame_scores, args.db_batch)
+
+
+if __name__ == '__main__':
+    main()
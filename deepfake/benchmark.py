@@ -0,0 +1,656 @@
+# -*- coding:utf-8 -*-
+'''
+CPU benchmarks for the deepfake detection code.
+
+    python benchmark.py inference [--frames 200] [--batch-sizes 1 8 32 64]
+    python benchmark.py engine [--video clip.mp4] [--workers 1 2 4]
+    python benchmark.py facebatch [--faces 50]
+    python benchmark.py detectors [--detectors cnn hog haar] [--videos a.mp4 ...] [--detect-every 1 5]
+    python benchmark.py align [--faces 200]
+    python benchmark.py lite [--weights weights/Meso4_DF.h5] [--frames 200]
+    python benchmark.py postgres [--rows 1000] [--database postgres]
+    python benchmark.py ensemble [--video clip.mp4] [--weights weights/*.h5]
+    python benchmark.py landmarks [--faces 10000] [--smooth-window 5]
+    python benchmark.py tracks [--video clip.mp4] [--detect-every 1 5 10]
+    python benchmark.py readers [--videos a.mp4 ...] [--backends opencv pyav] [--threads 0 1 4] [--scales 1 0.5 0.25]
+'''
+
+import argparse
+import glob
+import importlib.util
+import os
+import tempfile
+import time
+
+import numpy as np
+import cv2
+
+from readers import BACKENDS
+
+WEIGHTS = 'weights/Meso4_DF.h5'
+
+
+def synthetic_frames(n, height = 720, width = 1280, seed = 0):
+    ''' Random uint8 BGR frames standing in for decoded video '''
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def synthetic_video(path, n = 300, height = 1080, width = 1920, fps = 25):
+    ''' Writes a moving noise clip for benchmarks run without a sample video '''
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    base = synthetic_frames(1, height, width)[0]
+    for i in range(n):
+        writer.write(np.roll(base, 8 * i, axis = 1))
+    writer.release()
+    return path
+
+
+def report(label, count, elapsed, unit = 'frames'):
+    print('{:<40} {:8.1f} {}/s  ({:.3f} s)'.format(label, count / elapsed, unit, elapsed))
+
+
+## Commands
+
+def bench_inference(args):
+    ''' Per frame model.predict (the original app loop) against BatchPredictor '''
+    from classifiers import Meso4
+    from scoring import BatchPredictor
+
+    classifier = Meso4()
+    classifier.load(args.weights)
+    frames = synthetic_frames(args.frames)
+
+    # warm up both paths so graph building is not timed
+    classifier.model.predict(np.zeros((1, 256, 256, 3)), verbose=0)
+
+    start = time.perf_counter()
+    loop_scores = []
+    for frame in frames:
+        frame_resized = cv2.resize(frame, (256, 256))
+        frame_normalized = frame_resized / 255.0
+        frame_input = np.expand_dims(frame_normalized, axis=0)
+        loop_scores.append(classifier.model.predict(frame_input, verbose=0)[0][0])
+    report('per frame model.predict', len(frames), time.perf_counter() - start)
+
+    for batch_size in args.batch_sizes:
+        predictor = BatchPredictor(classifier, batch_size = batch_size)
+        predictor.add(frames[0])
+        predictor.flush()
+        predictor.scores = []
+
+        start = time.perf_counter()
+        for frame in frames:
+            predictor.add(frame)
+        predictor.flush()
+        report('BatchPredictor batch_size={}'.format(batch_size), len(frames), time.perf_counter() - start)
+        print('  max abs difference with the loop: {:.2e}'.format(
+            np.max(np.abs(np.array(predictor.scores) - np.array(loop_scores)))))
+
+
+def bench_engine(args):
+    ''' Serial decode/preprocess/predict loop against the pipelined VideoAnalysisEngine '''
+    from classifiers import Meso4
+    from engine import VideoAnalysisEngine
+    from sampling import FrameSampler
+    from scoring import BatchPredictor
+
+    classifier = Meso4()
+    classifier.load(args.weights)
+    path = args.video
+    if path is None:
+        path = synthetic_video(os.path.join(tempfile.mkdtemp(), 'bench.mp4'))
+    sampler = FrameSampler('every_nth', step = args.step)
+
+    predictor = BatchPredictor(classifier)
+    predictor.add(np.zeros((256, 256, 3), dtype=np.uint8))
+    predictor.flush()
+    predictor.scores = []
+
+    start = time.perf_counter()
+    cap = cv2.VideoCapture(path)
+    for index, frame in sampler.frames(cap, path):
+        predictor.add(frame)
+    predictor.flush()
+    cap.release()
+    report('serial', len(predictor.scores), time.perf_counter() - start)
+
+    for workers in args.workers:
+        engine = VideoAnalysisEngine(classifier, sampler = sampler, preprocess_workers = workers)
+        start = time.perf_counter()
+        scores = engine.run(path)
+        report('engine preprocess_workers={}'.format(workers), len(scores), time.perf_counter() - start)
+
+
+def bench_ensemble(args):
+    ''' One model, every model in separate passes over the video, and the shared-frames ensemble '''
+    from classifiers import load_ensemble
+    from engine import VideoAnalysisEngine
+    from sampling import FrameSampler
+
+    classifiers = load_ensemble(args.weights)
+    path = args.video
+    if path is None:
+        path = synthetic_video(os.path.join(tempfile.mkdtemp(), 'bench.mp4'))
+    sampler = FrameSampler('every_nth', step = args.step)
+    name, first = next(iter(classifiers.items()))
+
+    start = time.perf_counter()
+    scores = VideoAnalysisEngine(first, sampler = sampler).run(path)
+    report('one model ({})'.format(name), len(scores), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    separate = {name: VideoAnalysisEngine(c, sampler = sampler).run(path) for name, c in classifiers.items()}
+    report('{} models, one pass each'.format(len(classifiers)), len(scores), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    result = VideoAnalysisEngine(classifiers, sampler = sampler).analyse(path)
+    report('{} models, ensemble'.format(len(classifiers)), result['frames_used'], time.perf_counter() - start)
+    for name, model in result['models'].items():
+        diff = np.max(np.abs(np.array(model['scores']) - np.array(separate[name])))
+        print('  {:<24} avg {:.4f}  max |diff| with its own pass {:.6f}'.format(name, model['avg_probability'], diff))
+
+
+class SyntheticFaceFinder:
+    ''' FaceFinder stand-in serving random aligned faces, one per frame '''
+    def __init__(self, n, size = 180):
+        self.length = n
+        self.coordinates = {i: None for i in range(n)}
+        self.patches = synthetic_frames(n, size, size)
+
+    def get_aligned_face(self, i, size = None):
+        ''' size x size face when size is given, as FaceFinder.get_aligned_face '''
+        patch = self.patches[i]
+        if size is not None and patch.shape[:2] != (size, size):
+            patch = cv2.resize(patch, (size, size), interpolation = cv2.INTER_LINEAR)
+        return patch
+
+
+def concatenate_next_batch(generator, batch_size = 50):
+    ''' FaceBatchGenerator.next_batch before the preallocated buffer '''
+    batch = np.zeros((1, generator.target_size, generator.target_size, 3))
+    i = 0
+    while (i < batch_size) and (generator.head < generator.length):
+        if generator.head in generator.finder.coordinates:
+            patch = generator.finder.get_aligned_face(generator.head)
+            batch = np.concatenate((batch, np.expand_dims(generator.resize_patch(patch), axis = 0)),
+                                    axis = 0)
+            i += 1
+        generator.head += 1
+    return batch[1:]
+
+
+def bench_facebatch(args):
+    ''' np.concatenate face batches against the preallocated float32 buffer '''
+    import tracemalloc
+    from pipeline import FaceBatchGenerator
+
+    finder = SyntheticFaceFinder(args.faces)
+    for label, next_batch in (('np.concatenate (float64)', concatenate_next_batch),
+                              ('preallocated buffer (float32)', FaceBatchGenerator.next_batch)):
+        generator = FaceBatchGenerator(finder)
+        tracemalloc.start()
+        start = time.perf_counter()
+        batch = next_batch(generator, batch_size = args.faces)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        report(label, len(batch), elapsed, unit = 'faces')
+        print('  peak allocation {:.1f} MB, batch {} {}'.format(peak / 2**20, batch.dtype, batch.shape))
+
+
+def bench_detectors(args):
+    ''' Throughput and agreement of the face detector backends on test_images and local videos '''
+    from glob import glob
+    from pipeline import DETECTORS, FaceFinder, iou
+
+    images = [cv2.cvtColor(cv2.imread(f), cv2.COLOR_BGR2RGB)
+              for f in sorted(glob(os.path.join(args.images, '*', '*.jpg')))]
+    print('========== {} test images =========='.format(len(images)))
+    for name in args.detectors:
+        detector = DETECTORS[name]()
+        start = time.perf_counter()
+        found = sum(len(detector.detect_full_frame(image)) > 0 for image in images)
+        report(name, len(images), time.perf_counter() - start, unit = 'images')
+        print('  face found in {} / {}'.format(found, len(images)))
+
+    for video in args.videos:
+        print('========== {} =========='.format(video))
+        reference = None
+        for name in args.detectors:
+            for detect_every in args.detect_every:
+                finder = FaceFinder(video, load_first_face = False, detector = name)
+                start = time.perf_counter()
+                finder.find_faces(resize = 0.5, skipstep = args.skipstep, detect_every = detect_every)
+                elapsed = time.perf_counter() - start
+                frames = len(range(0, finder.length, args.skipstep + 1))
+                report('{} detect_every={}'.format(name, detect_every), frames, elapsed)
+                line = '  faces on {} / {} frames'.format(len(finder.faces), frames)
+                if reference is None:
+                    reference = finder.faces
+                else:
+                    common = [i for i in finder.faces if i in reference]
+                    if common:
+                        line += ', mean IoU with {} detect_every={}: {:.2f}'.format(
+                            args.detectors[0], args.detect_every[0],
+                            np.mean([iou(finder.faces[i], reference[i]) for i in common]))
+                print(line)
+
+
+def scipy_aligned_face(frame, coordinates, l_factor = 1.3, target_size = 256):
+    ''' get_aligned_face + resize_patch before cv2.warpAffine : pad, scipy rotate, crop, scipy zoom '''
+    from math import floor
+    from scipy.ndimage import rotate, zoom
+    from pipeline import FaceFinder
+
+    c, l, r = coordinates
+    l = int(l) * l_factor
+    dl_ = floor(np.sqrt(2) * l / 2)
+    patch = FaceFinder.get_image_slice(frame, floor(c[0] - dl_), floor(c[0] + dl_), floor(c[1] - dl_), floor(c[1] + dl_))
+    rotated_patch = rotate(patch, -r, reshape=False)
+    face = FaceFinder.get_image_slice(rotated_patch, floor(dl_-l//2), floor(dl_+l//2), floor(dl_-l//2), floor(dl_+l//2))
+    m, n = face.shape[:2]
+    return zoom(face, (target_size / m, target_size / n, 1))
+
+
+def bench_align(args):
+    ''' Face alignment with scipy pad/rotate/zoom against one cv2.warpAffine, with their difference '''
+    from pipeline import FaceFinder
+
+    class StillFaceFinder(FaceFinder):
+        ''' FaceFinder holding a single frame with known face coordinates '''
+        def __init__(self, frame, coordinates):
+            self.frame = frame
+            self.coordinates = {0: coordinates}
+
+        def get(self, i):
+            return self.frame
+
+    # a real face pasted in a 1080p frame, the border reflection gets exercised near the edges
+    face = cv2.cvtColor(cv2.imread(args.image), cv2.COLOR_BGR2RGB)
+    rng = np.random.default_rng(0)
+    cases = []
+    for _ in range(args.faces):
+        frame = np.zeros((1080, 1920, 3), dtype = np.uint8)
+        y, x = rng.integers(0, 1080 - 256), rng.integers(0, 1920 - 256)
+        frame[y:y + 256, x:x + 256] = face
+        c = (int(y + 128 + rng.integers(-10, 10)), int(x + 128 + rng.integers(-10, 10)))
+        cases.append(StillFaceFinder(frame, (c, int(rng.integers(120, 200)), float(rng.uniform(-30, 30)))))
+
+    start = time.perf_counter()
+    reference = [scipy_aligned_face(f.frame, f.coordinates[0]) for f in cases]
+    report('scipy pad + rotate + zoom', len(cases), time.perf_counter() - start, unit = 'faces')
+
+    start = time.perf_counter()
+    warped = [f.get_aligned_face(0, size = 256) for f in cases]
+    report('cv2.warpAffine', len(cases), time.perf_counter() - start, unit = 'faces')
+
+    diff = np.array([np.abs(a.astype(np.float32) - b.astype(np.float32)).mean() for a, b in zip(reference, warped)])
+    print('  mean abs difference (0-255) : mean {:.2f}, max {:.2f}'.format(diff.mean(), diff.max()))
+
+
+def bench_lite(args):
+    ''' Load time and throughput of the Keras model against its TFLite exports '''
+    from lite import LiteClassifier, lite_path
+
+    start = time.perf_counter()
+    from classifiers import Meso4
+    classifier = Meso4()
+    classifier.load(args.weights)
+    print('{:<40} {:8.3f} s'.format('keras import + build + load', time.perf_counter() - start))
+
+    x = np.stack([cv2.resize(f, (256, 256)) for f in synthetic_frames(args.frames)]).astype(np.float32) / 255.0
+    classifier.model.predict(x[:32], verbose=0)
+    start = time.perf_counter()
+    expected = classifier.model.predict(x, batch_size = 32, verbose=0)[:, 0]
+    report('keras predict', len(x), time.perf_counter() - start)
+
+    for quantized in (False, True):
+        path = lite_path(args.weights, quantized)
+        if not os.path.exists(path):
+            print(path, 'not found, run python export.py' + (' --int8' if quantized else ''))
+            continue
+        start = time.perf_counter()
+        lite = LiteClassifier(path)
+        print('{:<40} {:8.3f} s'.format('load ' + os.path.basename(path), time.perf_counter() - start))
+        lite.predict(x[:32])
+        start = time.perf_counter()
+        scores = np.concatenate([lite.predict(x[i:i + 32])[:, 0] for i in range(0, len(x), 32)])
+        report('predict ' + os.path.basename(path), len(x), time.perf_counter() - start)
+        print('  max |diff| with keras : {:.5f}'.format(float(np.max(np.abs(scores - expected)))))
+
+
+BENCH_TABLE = '''
+    CREATE TABLE evidence_metadata (
+        id SERIAL PRIMARY KEY,
+        case_id VARCHAR(100) NOT NULL,
+        evidence_id VARCHAR(100) NOT NULL,
+        file_path TEXT,
+        file_hash VARCHAR(64),
+        avg_probability DOUBLE PRECISION,
+        prediction VARCHAR(10),
+        frame_scores BYTEA,
+        deepfake_analyzed_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (case_id, evidence_id)
+    )
+'''
+
+# the statement of the original streamlit update_deepfake_result
+PER_ROW_UPDATE = '''
+    UPDATE evidence_metadata
+    SET avg_probability = %s, prediction = %s, deepfake_analyzed_at = NOW()
+    WHERE case_id = %s AND evidence_id = %s
+'''
+
+
+def bench_postgres(args):
+    '''
+    Writing deepfake results : one connection and UPDATE per result (the
+    original streamlit path) against the pool and batched updates of evidence.py.
+    Runs in a throwaway deepfake_bench schema of a local Postgres.
+    '''
+    import psycopg2
+    import evidence
+
+    config = dict(evidence.DB_CONFIG, database = args.database)
+    setup = psycopg2.connect(**config)
+    setup.autocommit = True
+    with setup.cursor() as cur:
+        cur.execute('DROP SCHEMA IF EXISTS deepfake_bench CASCADE')
+        cur.execute('CREATE SCHEMA deepfake_bench')
+        cur.execute('SET search_path TO deepfake_bench')
+        cur.execute(BENCH_TABLE)
+        cur.execute("INSERT INTO evidence_metadata (case_id, evidence_id) "
+                    "SELECT 'C' || (i % 50), 'E' || i FROM generate_series(1, %s) AS i", (args.rows,))
+
+    # everything below only sees the benchmark schema
+    evidence.DB_CONFIG = dict(config, options = '-c search_path=deepfake_bench')
+    rng = np.random.default_rng(0)
+    results = [{'case_id': 'C' + str(i % 50), 'evidence_id': 'E' + str(i),
+                'avg_probability': float(p), 'prediction': 'FAKE' if p > 0.5 else 'REAL',
+                'frame_scores': rng.random(args.frames)}
+               for i, p in enumerate(rng.random(args.rows), 1)]
+    try:
+        start = time.perf_counter()
+        for r in results:
+            conn = psycopg2.connect(**evidence.DB_CONFIG)
+            cur = conn.cursor()
+            cur.execute(PER_ROW_UPDATE,
+                        (r['avg_probability'], r['prediction'], r['case_id'], r['evidence_id']))
+            conn.commit()
+            cur.close()
+            conn.close()
+        report('connect + UPDATE per result', len(results), time.perf_counter() - start, unit = 'results')
+
+        start = time.perf_counter()
+        for r in results:
+            evidence.update_result(r['case_id'], r['evidence_id'], r['avg_probability'], r['prediction'])
+        report('pooled UPDATE per result', len(results), time.perf_counter() - start, unit = 'results')
+
+        scoreless = [dict(r, frame_scores = None) for r in results]
+        start = time.perf_counter()
+        updated = evidence.update_results(scoreless)
+        report('batched update_results', len(results), time.perf_counter() - start, unit = 'results')
+        assert len(updated) == len(results)
+
+        start = time.perf_counter()
+        evidence.update_results(results)
+        report('batched, with {} frame scores'.format(args.frames), len(results), time.perf_counter() - start, unit = 'results')
+
+        with evidence.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT frame_scores FROM evidence_metadata WHERE evidence_id = 'E1'")
+            stored = evidence.decode_scores(cur.fetchone()[0])
+        print('  frame_scores : {} bytes per video, max float16 error {:.5f}'.format(
+            stored.nbytes // 2, float(np.max(np.abs(stored - results[0]['frame_scores'])))))
+    finally:
+        evidence.close_pool()
+        with setup.cursor() as cur:
+            cur.execute('DROP SCHEMA deepfake_bench CASCADE')
+        setup.close()
+
+
+# face_recognition point counts of the landmark groups used by the alignment
+LANDMARK_POINTS = {'left_eye': 6, 'right_eye': 6, 'nose_tip': 5, 'nose_bridge': 4, 'top_lip': 12, 'bottom_lip': 12}
+LANDMARK_OFFSETS = {'left_eye': (-30, -20), 'right_eye': (30, -20), 'nose_tip': (0, 10),
+                    'nose_bridge': (0, -5), 'top_lip': (0, 35), 'bottom_lip': (0, 45)}
+
+
+def synthetic_landmarks(n, jitter = 2.0, seed = 0):
+    ''' Landmark dicts of a slowly moving, tilting face with per-frame detection noise '''
+    rng = np.random.default_rng(seed)
+    landmarks = []
+    for i in range(n):
+        cx, cy, angle = 640 + 100 * np.sin(i / 200), 360 + 50 * np.cos(i / 300), 0.3 * np.sin(i / 100)
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        landmarks.append({
+            group: [tuple(int(v) for v in rotation.dot(LANDMARK_OFFSETS[group]) + (cx, cy) + rng.normal(0, jitter, 2))
+                    for _ in range(count)]
+            for group, count in LANDMARK_POINTS.items()})
+    return landmarks
+
+
+def loop_find_coordinates(landmark, K = 2.2):
+    ''' The former per-frame FaceFinder.find_coordinates '''
+    from math import floor
+    L2 = lambda A, B: np.sqrt(np.sum(np.square(A - B)))
+    E1 = np.mean(landmark['left_eye'], axis=0)
+    E2 = np.mean(landmark['right_eye'], axis=0)
+    E = (E1 + E2) / 2
+    N = np.mean(landmark['nose_tip'], axis=0) / 2 + np.mean(landmark['nose_bridge'], axis=0) / 2
+    B1 = np.mean(landmark['top_lip'], axis=0)
+    B2 = np.mean(landmark['bottom_lip'], axis=0)
+    B = (B1 + B2) / 2
+    C = N
+    l = max(L2(E1, E2), L2(B, E)) * K
+    if (B[1] == E[1]):
+        rot = 90 if B[0] > E[0] else -90
+    else:
+        rot = np.arctan((B[0] - E[0]) / (B[1] - E[1])) / np.pi * 180
+    return ((floor(C[1]), floor(C[0])), floor(l), rot)
+
+
+def bench_landmarks(args):
+    ''' Per-frame landmark geometry against the batched landmark_alignment, and temporal smoothing '''
+    from pipeline import landmark_alignment, smooth_coordinates
+
+    landmarks = synthetic_landmarks(args.faces)
+
+    start = time.perf_counter()
+    loop = [loop_find_coordinates(lm) for lm in landmarks]
+    report('per-frame find_coordinates', len(loop), time.perf_counter() - start, unit = 'faces')
+
+    start = time.perf_counter()
+    centers, lengths, rotations = landmark_alignment(landmarks)
+    report('batched landmark_alignment', len(landmarks), time.perf_counter() - start, unit = 'faces')
+    same = all(tuple(c) == l[0] and n == l[1] and abs(r - l[2]) < 1e-9
+               for c, n, r, l in zip(centers.tolist(), lengths.tolist(), rotations.tolist(), loop))
+    print('  identical to the per-frame results :', same)
+
+    coordinates = dict(enumerate(loop))
+    start = time.perf_counter()
+    smoothed = smooth_coordinates(coordinates, args.smooth_window)
+    report('smooth_coordinates window={}'.format(args.smooth_window), len(smoothed), time.perf_counter() - start, unit = 'faces')
+    # frame to frame jitter of the face centre and rotation
+    for label, coords in (('raw', coordinates), ('smoothed', smoothed)):
+        c = np.array([coords[i][0] for i in sorted(coords)], dtype = np.float64)
+        r = np.array([coords[i][2] for i in sorted(coords)])
+        print('  {:<9} centre jitter {:.2f} px, rotation jitter {:.2f} deg'.format(
+            label, np.abs(np.diff(c, axis = 0)).mean(), np.abs(np.diff(r)).mean()))
+
+
+def synthetic_face_video(path, image, n = 250, height = 720, width = 1280, fps = 25):
+    ''' A face image sliding over a dark noise background '''
+    face = cv2.imread(image)
+    h, w = face.shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    background = (synthetic_frames(1, height, width)[0] // 4)
+    for i in range(n):
+        frame = background.copy()
+        x = int((width - w) * i / n)
+        frame[(height - h) // 2:(height + h) // 2, x:x + w] = face
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def bench_tracks(args):
+    ''' Whole-frame VideoAnalysisEngine against face-track scoring, for several detection intervals '''
+    from classifiers import load_classifier
+    from engine import VideoAnalysisEngine
+    from sampling import FrameSampler
+    from tracks import FaceTrackScorer
+
+    classifier = load_classifier('Meso4', args.weights)
+    path = args.video
+    if path is None:
+        path = synthetic_face_video(os.path.join(tempfile.mkdtemp(), 'faces.mp4'), args.image)
+    sampler = FrameSampler('every_nth', step = args.step)
+
+    start = time.perf_counter()
+    result = VideoAnalysisEngine(classifier, sampler = sampler).analyse(path)
+    report('whole frames', result['frames_used'], time.perf_counter() - start)
+    print('  avg {:.4f}'.format(result['avg_probability']))
+
+    for detect_every in args.detect_every:
+        start = time.perf_counter()
+        result = FaceTrackScorer(classifier, sampler = sampler, detect_every = detect_every).analyse(path)
+        report('face tracks detect_every={}'.format(detect_every), result['frames_used'],
+               time.perf_counter() - start, unit = 'faces')
+        print('  avg {}  {} tracks'.format(result['avg_probability'], len(result['tracks'])))
+
+
+def time_reader(path, sampler, **options):
+    ''' Frames read per second through readers.open_video, and the frame shape '''
+    from readers import open_video
+
+    start = time.perf_counter()
+    cap = open_video(path, **options)
+    try:
+        count, shape = 0, None
+        for index, frame in sampler.frames(cap, path):
+            count += 1
+            shape = frame.shape
+    finally:
+        cap.release()
+    return count, time.perf_counter() - start, shape
+
+
+def bench_readers(args):
+    ''' Video opening (count_frames against metadata) and decoding per reader backend, thread count and scale '''
+    import imageio
+    from pipeline import Video
+    from sampling import FrameSampler
+
+    backends = []
+    for backend in args.backends:
+        if backend == 'pyav' and importlib.util.find_spec('av') is None:
+            print('PyAV not installed (pip install av), skipping its backend')
+            continue
+        backends.append(backend)
+
+    paths = args.videos
+    if not paths:
+        tmp = tempfile.mkdtemp()
+        paths = [synthetic_video(os.path.join(tmp, '1080p.mp4'), args.frames, 1080, 1920),
+                 synthetic_video(os.path.join(tmp, '4k.mp4'), args.frames, 2160, 3840)]
+    sampler = FrameSampler('every_nth', step = args.step)
+
+    for path in paths:
+        print(os.path.basename(path))
+        start = time.perf_counter()
+        counted = imageio.get_reader(path, 'ffmpeg').count_frames()
+        report('  open + count_frames()', 1, time.perf_counter() - start, unit = 'videos')
+        start = time.perf_counter()
+        length = len(Video(path))
+        report('  open + metadata (Video)', 1, time.perf_counter() - start, unit = 'videos')
+        print('    {} frames counted, {} from the metadata'.format(counted, length))
+
+        for backend in backends:
+            for threads in args.threads:
+                for scale in args.scales:
+                    count, elapsed, shape = time_reader(path, sampler, backend = backend, threads = threads, scale = scale)
+                    report('  {} threads={} scale={} {}x{}'.format(backend, threads, scale, shape[1], shape[0]),
+                           count, elapsed)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    inference = commands.add_parser('inference', help = bench_inference.__doc__)
+    inference.add_argument('--weights', default = WEIGHTS)
+    inference.add_argument('--frames', type = int, default = 200)
+    inference.add_argument('--batch-sizes', type = int, nargs = '+', default = [1, 8, 32, 64])
+    inference.set_defaults(func = bench_inference)
+
+    engine = commands.add_parser('engine', help = bench_engine.__doc__)
+    engine.add_argument('--weights', default = WEIGHTS)
+    engine.add_argument('--video', help = 'clip to score, a synthetic 1080p clip by default')
+    engine.add_argument('--step', type = int, default = 10)
+    engine.add_argument('--workers', type = int, nargs = '+', default = [1, 2, 4])
+    engine.set_defaults(func = bench_engine)
+
+    ensemble = commands.add_parser('ensemble', help = bench_ensemble.__doc__)
+    ensemble.add_argument('--weights', nargs = '+', default = sorted(glob.glob('weights/*.h5')))
+    ensemble.add_argument('--video', help = 'clip to score, a synthetic 1080p clip by default')
+    ensemble.add_argument('--step', type = int, default = 10)
+    ensemble.set_defaults(func = bench_ensemble)
+
+    landmarks = commands.add_parser('landmarks', help = bench_landmarks.__doc__)
+    landmarks.add_argument('--faces', type = int, default = 10000)
+    landmarks.add_argument('--smooth-window', type = int, default = 5)
+    landmarks.set_defaults(func = bench_landmarks)
+
+    tracks = commands.add_parser('tracks', help = bench_tracks.__doc__)
+    tracks.add_argument('--weights', default = WEIGHTS)
+    tracks.add_argument('--video', help = 'clip to score, a synthetic clip of a moving face by default')
+    tracks.add_argument('--image', default = 'test_images/real/real00240.jpg')
+    tracks.add_argument('--step', type = int, default = 5)
+    tracks.add_argument('--detect-every', type = int, nargs = '+', default = [1, 5, 10])
+    tracks.set_defaults(func = bench_tracks)
+
+    readers = commands.add_parser('readers', help = bench_readers.__doc__)
+    readers.add_argument('--videos', nargs = '*', help = 'clips to read, synthetic 1080p and 4K clips by default')
+    readers.add_argument('--frames', type = int, default = 100, help = 'length of the synthetic clips')
+    readers.add_argument('--backends', nargs = '+', choices = BACKENDS, default = list(BACKENDS))
+    readers.add_argument('--threads', type = int, nargs = '+', default = [0, 1, 4])
+    readers.add_argument('--scales', type = float, nargs = '+', default = [1, 0.5, 0.25])
+    readers.add_argument('--step', type = int, default = 1, help = 'read every step-th frame')
+    readers.set_defaults(func = bench_readers)
+
+    facebatch = commands.add_parser('facebatch', help = bench_facebatch.__doc__)
+    facebatch.add_argument('--faces', type = int, default = 50)
+    facebatch.set_defaults(func = bench_facebatch)
+
+    detectors = commands.add_parser('detectors', help = bench_detectors.__doc__)
+    detectors.add_argument('--detectors', nargs = '+', default = ['cnn', 'hog', 'haar'])
+    detectors.add_argument('--images', default = 'test_images')
+    detectors.add_argument('--videos', nargs = '*', default = [])
+    detectors.add_argument('--skipstep', type = int, default = 0)
+    detectors.add_argument('--detect-every', type = int, nargs = '+', default = [1, 5])
+    detectors.set_defaults(func = bench_detectors)
+
+    align = commands.add_parser('align', help = bench_align.__doc__)
+    align.add_argument('--faces', type = int, default = 200)
+    align.add_argument('--image', default = 'test_images/real/real00240.jpg')
+    align.set_defaults(func = bench_align)
+
+    lite = commands.add_parser('lite', help = bench_lite.__doc__)
+    lite.add_argument('--weights', default = WEIGHTS)
+    lite.add_argument('--frames', type = int, default = 200)
+    lite.set_defaults(func = bench_lite)
+
+    postgres = commands.add_parser('postgres', help = bench_postgres.__doc__)
+    postgres.add_argument('--database', default = 'postgres')
+    postgres.add_argument('--rows', type = int, default = 1000)
+    postgres.add_argument('--frames', type = int, default = 60, help = 'frame scores stored per video')
+    postgres.set_defaults(func = bench_postgres)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
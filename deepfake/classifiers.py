@@ -1,5 +1,10 @@
 # -*- coding:utf-8 -*-
 
+import os
+import threading
+
+import numpy as np
+
 try:
     # Use Keras 2.x which is more compatible
     from tensorflow.keras.models import Model as KerasModel
@@ -17,9 +22,18 @@ except ImportError:
 IMGWIDTH = 256
 
 class Classifier:
-    def __init__():
+    def __init__(self):
         self.model = 0
     
+    def compile(self, learning_rate):
+        optimizer = Adam(learning_rate = learning_rate)
+        self.model.compile(optimizer = optimizer, loss = 'mean_squared_error', metrics = ['accuracy'])
+    
+    def warm_up(self, batch_size = 1):
+        ''' Runs a dummy batch so graph tracing is not paid by the first real prediction '''
+        from scoring import compile_predict
+        compile_predict(self.model)(np.zeros((batch_size, IMGWIDTH, IMGWIDTH, 3), dtype=np.float32))
+    
     def predict(self, x):
         if x.size == 0:
             return []
@@ -39,10 +53,10 @@ class Meso1(Classifier):
     """
     Feature extraction + Classification
     """
-    def __init__(self, learning_rate = 0.001, dl_rate = 1):
+    def __init__(self, learning_rate = 0.001, dl_rate = 1, inference_only = False):
         self.model = self.init_model(dl_rate)
-        optimizer = Adam(lr = learning_rate)
-        self.model.compile(optimizer = optimizer, loss = 'mean_squared_error', metrics = ['accuracy'])
+        if not inference_only:
+            self.compile(learning_rate)
     
     def init_model(self, dl_rate):
         x = Input(shape = (IMGWIDTH, IMGWIDTH, 3))
@@ -59,10 +73,10 @@ class Meso1(Classifier):
 
 
 class Meso4(Classifier):
-    def __init__(self, learning_rate = 0.001):
+    def __init__(self, learning_rate = 0.001, inference_only = False):
         self.model = self.init_model()
-        optimizer = Adam(learning_rate = learning_rate)
-        self.model.compile(optimizer = optimizer, loss = 'mean_squared_error', metrics = ['accuracy'])
+        if not inference_only:
+            self.compile(learning_rate)
     
     def init_model(self): 
         x = Input(shape = (IMGWIDTH, IMGWIDTH, 3))
@@ -94,10 +108,10 @@ class Meso4(Classifier):
 
 
 class MesoInception4(Classifier):
-    def __init__(self, learning_rate = 0.001):
+    def __init__(self, learning_rate = 0.001, inference_only = False):
         self.model = self.init_model()
-        optimizer = Adam(learning_rate = learning_rate)
-        self.model.compile(optimizer = optimizer, loss = 'mean_squared_error', metrics = ['accuracy'])
+        if not inference_only:
+            self.compile(learning_rate)
     
     def InceptionLayer(self, a, b, c, d):
         def func(x):
@@ -144,3 +158,41 @@ class MesoInception4(Classifier):
         y = Dense(1, activation = 'sigmoid')(y)
 
         return KerasModel(inputs = x, outputs = y)
+
+
+## Shared inference models
+
+# inference only classifiers of this process, by (architecture, weights path)
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def architecture_for(weights_path):
+    ''' Classifier class of a shipped weights file (Meso4_*.h5, MesoInception_*.h5) '''
+    return MesoInception4 if os.path.basename(weights_path).startswith('MesoInception') else Meso4
+
+
+def load_classifier(architecture, weights_path, warm_up = True):
+    '''
+    Inference only classifier (no optimizer, not compiled) with its weights loaded.
+    The graph is built once per process : later calls with the same
+    architecture and weights return the same, already warmed up, instance.
+    architecture is a Classifier subclass or its name ('Meso4', 'MesoInception4').
+    '''
+    if isinstance(architecture, str):
+        architecture = globals()[architecture]
+    key = (architecture.__name__, os.path.abspath(weights_path))
+    with _registry_lock:
+        if key not in _registry:
+            classifier = architecture(inference_only = True)
+            classifier.load(weights_path)
+            if warm_up:
+                classifier.warm_up()
+            _registry[key] = classifier
+        return _registry[key]
+
+
+def load_ensemble(weights_paths, warm_up = True):
+    ''' {name: classifier} of weights files, for an ensemble analysis (see engine.VideoAnalysisEngine) '''
+    return {os.path.splitext(os.path.basename(path))[0]: load_classifier(architecture_for(path), path, warm_up)
+            for path in weights_paths}
@@ -0,0 +1,152 @@
+# -*- coding:utf-8 -*-
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from readers import open_video
+from sampling import FrameSampler
+from scoring import BatchPredictor, EnsemblePredictor, preprocess
+
+_DONE = object()
+
+
+## Pipelined video analysis
+
+def summarise(scores):
+    ''' Average fake probability and verdict of frame scores '''
+    avg = float(np.mean(scores)) if scores else None
+    return {
+        'scores': scores,
+        'avg_probability': avg,
+        'prediction': None if avg is None else ('FAKE' if avg > 0.5 else 'REAL'),
+        'frames_used': len(scores),
+    }
+
+
+class VideoAnalysisEngine:
+    '''
+    Scores a video with overlapping stages :
+
+        decoder thread --> preprocessing pool --> inference (calling thread)
+
+    The decoder hands every sampled frame to the pool and queues the pending
+    result. The queue is bounded (queue_size frames), so a slow inference stage
+    blocks the decoder instead of piling up frames in memory. Scores come out
+    in frame order.
+    OpenCV decoding, cv2.resize and TensorFlow all release the GIL, so the
+    stages run in parallel and a video takes about as long as its slowest stage.
+    classifier may be a {name: classifier} ensemble : frames are then decoded
+    and preprocessed once for all the models (see scoring.EnsemblePredictor).
+    reader holds the readers.open_video options (backend, threads, scale).
+    '''
+    def __init__(self, classifier, sampler = None, batch_size = 32, preprocess_workers = 2, queue_size = 64, reader = None):
+        self.classifier = classifier
+        self.reader = reader or {}
+        self.sampler = sampler if sampler is not None else FrameSampler('every_nth', step = 10)
+        self.batch_size = batch_size
+        self.preprocess_workers = preprocess_workers
+        self.queue_size = queue_size
+
+    def _decode(self, path, pool, pending, stop, errors):
+        cap = open_video(path, **self.reader)
+        try:
+            for index, frame in self.sampler.frames(cap, path):
+                item = (index, pool.submit(preprocess, frame))
+                while not stop.is_set():
+                    try:
+                        pending.put(item, timeout = 0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            cap.release()
+            pending.put(_DONE)
+
+    def frames(self, path):
+        ''' Yields (index, preprocessed frame) in order, decoding and preprocessing ahead in the background '''
+        pending = queue.Queue(maxsize = self.queue_size)
+        stop = threading.Event()
+        errors = []
+        with ThreadPoolExecutor(max_workers = self.preprocess_workers) as pool:
+            decoder = threading.Thread(target = self._decode, args = (path, pool, pending, stop, errors), daemon = True)
+            decoder.start()
+            try:
+                while True:
+                    item = pending.get()
+                    if item is _DONE:
+                        break
+                    index, future = item
+                    yield index, future.result()
+            finally:
+                stop.set()
+                # unblock the decoder if it is waiting on a full queue
+                while decoder.is_alive():
+                    try:
+                        pending.get(timeout = 0.1)
+                    except queue.Empty:
+                        pass
+        if errors:
+            raise errors[0]
+
+    def analyse(self, path, progress = None, early_stop = None):
+        '''
+        Scores the sampled frames of the video and sums them up.
+        early_stop is an optional scoring.SequentialTest : decoding stops as soon
+        as it settles the verdict, checked after every batch.
+        progress(frame_count, total_frames) is called from the calling thread.
+        '''
+        if isinstance(self.classifier, dict):
+            predictor = EnsemblePredictor(self.classifier, batch_size = self.batch_size)
+        else:
+            predictor = BatchPredictor(self.classifier, batch_size = self.batch_size)
+        cap = open_video(path, **self.reader)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        stopped_early = False
+        frames = self.frames(path)
+        try:
+            for index, x in frames:
+                scores = predictor.add_preprocessed(x)
+                if progress is not None:
+                    progress(index + 1, total_frames)
+                if early_stop is not None and scores and early_stop.update(scores):
+                    stopped_early = True
+                    break
+        finally:
+            frames.close()
+        if not stopped_early:
+            scores = predictor.flush()
+            if early_stop is not None:
+                early_stop.update(scores)
+        if progress is not None:
+            progress(total_frames, total_frames)
+
+        result = summarise(predictor.scores)
+        result['stopped_early'] = stopped_early
+        result['confidence'] = early_stop.confidence if early_stop is not None else None
+        if isinstance(predictor, EnsemblePredictor):
+            result['models'] = {name: summarise(scores) for name, scores in predictor.model_scores.items()}
+        return result
+
+    def run(self, path, progress = None):
+        ''' Fake probability of every sampled frame of the video '''
+        return self.analyse(path, progress)['scores']
+
+
+def score_video(path, classifier, sampler = None, batch_size = 32, progress = None):
+    '''
+    Fake probability of the frames of a video picked by sampler
+    (every 10th frame by default).
+    progress(frame_count, total_frames) is called after each sampled frame.
+    '''
+    engine = VideoAnalysisEngine(classifier, sampler = sampler, batch_size = batch_size)
+    return engine.run(path, progress = progress)
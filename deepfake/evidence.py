@@ -0,0 +1,145 @@
+# -*- coding:utf-8 -*-
+'''
+Deepfake results in the evidence_metadata table of the backend Postgres
+database (the row is created by the Node backend on upload).
+
+Connections come from a pool shared by the threads of the process, and
+results are written in batches : one UPDATE ... FROM (VALUES ...) statement
+per page of results instead of one connection and statement per video.
+'''
+
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+DB_CONFIG = {
+    'host': 'localhost',
+    'database': 'postgres',
+    'user': 'postgres',
+    'password': 'vvss',
+    'port': 5432,
+}
+MIN_CONNECTIONS = 1
+MAX_CONNECTIONS = 8
+PAGE_SIZE = 500
+
+# frame scores are stored as little-endian float16 : 2 bytes per frame
+SCORES_DTYPE = np.dtype('<f2')
+
+# filled by execute_values, one row per result
+UPDATE_RESULTS = '''
+    UPDATE evidence_metadata AS e
+    SET
+        avg_probability = v.avg_probability,
+        prediction = v.prediction,{frame_scores}
+        deepfake_analyzed_at = NOW()
+    FROM (VALUES %s) AS v ({columns})
+    WHERE e.case_id = v.case_id
+      AND e.evidence_id = v.evidence_id{match_hash}
+    RETURNING e.case_id, e.evidence_id
+'''
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+## Connections
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadedConnectionPool(MIN_CONNECTIONS, MAX_CONNECTIONS, **DB_CONFIG)
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def connection():
+    ''' Pooled connection, committed on success and rolled back on error, closed when broken '''
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        with conn:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        # a dead connection (server restarted, network cut) is dropped, not reused
+        pool.putconn(conn, close = broken or bool(conn.closed))
+
+
+## Results
+
+def encode_scores(scores):
+    return psycopg2.Binary(np.asarray(scores, dtype=SCORES_DTYPE).tobytes())
+
+
+def decode_scores(data):
+    ''' Frame scores of a frame_scores column value '''
+    return np.frombuffer(bytes(data), dtype=SCORES_DTYPE).astype(np.float32)
+
+
+def update_results(results, page_size = PAGE_SIZE):
+    '''
+    Stores the verdicts of many evidence videos, returns the set of
+    (case_id, evidence_id) rows updated. results are dicts with case_id,
+    evidence_id, avg_probability, prediction and optionally :
+        file_hash    : SHA-256 of the analysed file, the row must have been uploaded with it
+        frame_scores : per-frame scores, stored in the frame_scores column
+    Both are used for a batch only when every result has them.
+    '''
+    results = list(results)
+    if not results:
+        return set()
+    with_hash = all(r.get('file_hash') for r in results)
+    with_scores = all(r.get('frame_scores') is not None for r in results)
+
+    columns = ['case_id', 'evidence_id', 'avg_probability', 'prediction']
+    if with_hash:
+        columns.append('file_hash')
+    if with_scores:
+        columns.append('frame_scores')
+    query = UPDATE_RESULTS.format(
+        columns = ', '.join(columns),
+        frame_scores = '\n        frame_scores = v.frame_scores,' if with_scores else '',
+        match_hash = '\n      AND e.file_hash = v.file_hash' if with_hash else '')
+
+    rows = []
+    for r in results:
+        row = [r['case_id'], r['evidence_id'], float(r['avg_probability']), r['prediction']]
+        if with_hash:
+            row.append(r['file_hash'])
+        if with_scores:
+            row.append(encode_scores(r['frame_scores']))
+        rows.append(tuple(row))
+
+    with connection() as conn, conn.cursor() as cur:
+        updated = execute_values(cur, query, rows, page_size = page_size, fetch = True)
+    return set(updated)
+
+
+def update_result(case_id, evidence_id, avg_probability, prediction, file_hash = None, frame_scores = None):
+    '''
+    Stores the verdict of an evidence video, returns the number of rows updated
+    (0 if unknown). With file_hash, the SHA-256 of the analysed file, the row
+    must also have been uploaded with that file.
+    '''
+    return len(update_results([{
+        'case_id': case_id, 'evidence_id': evidence_id,
+        'avg_probability': avg_probability, 'prediction': prediction,
+        'file_hash': file_hash, 'frame_scores': frame_scores,
+    }]))
@@ -0,0 +1,98 @@
+# -*- coding:utf-8 -*-
+'''
+Exports the Keras weights of the Meso classifiers to TFLite models that
+lite.LiteClassifier loads without TensorFlow/Keras.
+
+    python export.py [weights/Meso4_DF.h5 ...] [--int8] [--images test_images]
+
+Every .h5 file of weights/ is exported by default, next to its weights
+(weights/Meso4_DF.h5 -> weights/Meso4_DF.tflite, weights/Meso4_DF_int8.tflite).
+--int8 also writes a quantised variant, calibrated on the images of --images.
+Each export is checked against the Keras model on --images : largest score
+difference and accuracy of both.
+'''
+
+import argparse
+import glob
+import os
+
+import numpy as np
+import cv2
+
+from lite import LiteClassifier, lite_path
+
+IMGWIDTH = 256
+
+
+def classifier_for(weights_path):
+    ''' Keras classifier matching a weights file name (Meso4_*, MesoInception_*) '''
+    from classifiers import architecture_for, load_classifier
+    return load_classifier(architecture_for(weights_path), weights_path, warm_up = False)
+
+
+def load_images(dirname):
+    '''
+    RGB images of dirname scaled to [0, 1], with their class index.
+    Classes are the sub directories in alphabetical order, as with the keras
+    flow_from_directory the models were evaluated with.
+    '''
+    classes = sorted(d for d in os.listdir(dirname) if os.path.isdir(os.path.join(dirname, d)))
+    x, y = [], []
+    for label, name in enumerate(classes):
+        for path in sorted(glob.glob(os.path.join(dirname, name, '*'))):
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (IMGWIDTH, IMGWIDTH))
+            x.append(image.astype(np.float32) / 255.0)
+            y.append(label)
+    return np.stack(x), np.array(y)
+
+
+def export(weights_path, quantized = False, calibration = None):
+    ''' Converts a weights file, returns the path of the .tflite model '''
+    import tensorflow as tf
+
+    classifier = classifier_for(weights_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(classifier.model)
+    if quantized:
+        # int8 weights and activations, float input and output
+        def representative_dataset():
+            for x in calibration:
+                yield [x[np.newaxis]]
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    path = lite_path(weights_path, quantized)
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    return path
+
+
+def check_parity(weights_path, lite_model, x, y):
+    ''' Compares the scores of an exported model with the Keras ones '''
+    expected = classifier_for(weights_path).model.predict(x, verbose=0)[:, 0]
+    scores = LiteClassifier(lite_model).predict(x)[:, 0]
+    print('{:<36} max |diff| {:.5f}  accuracy keras {:.3f}  tflite {:.3f}  ({:.0f} kB)'.format(
+        os.path.basename(lite_model), float(np.max(np.abs(scores - expected))),
+        float(np.mean((expected > 0.5) == y)), float(np.mean((scores > 0.5) == y)),
+        os.path.getsize(lite_model) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('weights', nargs = '*', default = sorted(glob.glob('weights/*.h5')))
+    parser.add_argument('--int8', action = 'store_true', help = 'also export an int8 quantised model')
+    parser.add_argument('--images', default = 'test_images', help = 'parity check and calibration images')
+    args = parser.parse_args()
+
+    x, y = load_images(args.images)
+    for weights_path in args.weights:
+        for quantized in ([False, True] if args.int8 else [False]):
+            lite_model = export(weights_path, quantized, calibration = x)
+            check_parity(weights_path, lite_model, x, y)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# -*- coding:utf-8 -*-
+
+import hashlib
+
+CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(path):
+    '''
+    SHA-256 hex digest of a file, read in chunks.
+    Same value as insert.generate_video_hash, the hash stored on chain.
+    '''
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def save_stream(src, path, length = None, chunk_size = CHUNK_SIZE):
+    '''
+    Copies a readable binary stream (upload, request body) to path in chunks
+    and returns the SHA-256 hex digest of the bytes written, so the file does
+    not need to be read again to be hashed.
+    length : number of bytes to copy, everything up to EOF by default.
+    '''
+    sha256 = hashlib.sha256()
+    remaining = length
+    with open(path, 'wb') as f:
+        while remaining is None or remaining > 0:
+            chunk = src.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                if remaining is not None:
+                    raise EOFError('stream ended {} bytes early'.format(remaining))
+                break
+            sha256.update(chunk)
+            f.write(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return sha256.hexdigest()
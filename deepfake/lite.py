@@ -0,0 +1,62 @@
+# -*- coding:utf-8 -*-
+'''
+TFLite inference for the exported Meso classifiers (see export.py).
+Only needs the tflite-runtime package (TensorFlow is used if it is missing) :
+no Keras model to build, no optimizer to compile, no LeakyReLU patching.
+'''
+
+import os
+import threading
+
+import numpy as np
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    try:
+        from tensorflow.lite import Interpreter
+    except ImportError:
+        raise ImportError("Failed to import a TFLite interpreter. Please install: pip install tflite-runtime")
+
+
+def lite_path(weights_path, quantized = False):
+    ''' Exported model path of a .h5 weights file '''
+    root = os.path.splitext(weights_path)[0]
+    return root + ('_int8.tflite' if quantized else '.tflite')
+
+
+class LiteClassifier:
+    '''
+    Same predict API as classifiers.Classifier on a .tflite model.
+    The interpreter is not thread safe : predict calls are serialised, so that
+    one LiteClassifier can be shared (the Streamlit sessions share the cached
+    one). num_threads sets the interpreter's own threads for each call.
+    '''
+    def __init__(self, path = None, num_threads = None):
+        self.num_threads = num_threads
+        self.interpreter = None
+        self.lock = threading.Lock()
+        if path is not None:
+            self.load(path)
+
+    def load(self, path):
+        self.interpreter = Interpreter(model_path = path, num_threads = self.num_threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = None
+
+    def predict(self, x):
+        if x.size == 0:
+            return []
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 3:
+            x = x[np.newaxis]
+        with self.lock:
+            if len(x) != self.batch_size:
+                # the input is resized on batch length changes only
+                self.interpreter.resize_tensor_input(self.input['index'], x.shape)
+                self.interpreter.allocate_tensors()
+                self.batch_size = len(x)
+            self.interpreter.set_tensor(self.input['index'], x)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output['index']).copy()
@@ -1,25 +1,91 @@
 # -*- coding:utf-8 -*-
 
+import hashlib
+import json
 import random
-from os import listdir
+from collections import OrderedDict
+from os import listdir, makedirs
 from os.path import isfile, join
 
 import numpy as np
+import cv2
 from math import floor
-from scipy.ndimage.interpolation import zoom, rotate
 
 import imageio
-import face_recognition
+try:
+    import face_recognition
+except ImportError:
+    face_recognition = None  # needed by FaceRecognitionDetector, FaceFinder falls back to unrotated crops
+
+from hashing import file_sha256
+from readers import scaled_size
+from sampling import FrameSampler
 
 
 ## Face extraction
 
+class FrameCache:
+    '''
+    Least recently used decoded frames, bounded by their total size in MB.
+    Cached frames are read-only as they are shared by every caller.
+    '''
+    def __init__(self, max_mb = 256):
+        self.max_bytes = max_mb * 2**20
+        self.frames = OrderedDict()
+        self.size = 0
+    
+    def get(self, key):
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.frames.move_to_end(key)
+        return frame
+    
+    def put(self, key, frame):
+        if frame.nbytes > self.max_bytes:
+            return
+        frame.flags.writeable = False
+        self.frames[key] = frame
+        self.size += frame.nbytes
+        while self.size > self.max_bytes:
+            _, old = self.frames.popitem(last = False)
+            self.size -= old.nbytes
+    
+    def __len__(self):
+        return len(self.frames)
+
+
 class Video:
-    def __init__(self, path):
+    '''
+    cache_mb bounds the decoded frames kept in memory. It should hold the
+    sampled frameset so that the frames read by find_faces are not decoded
+    again by get_aligned_face (30 frames of 1080p are about 180 MB).
+    threads : ffmpeg decoding threads (0 : ffmpeg's choice)
+    scale   : frames are decoded then scaled down by ffmpeg, locations and
+              faces are then those of the reduced frames
+    The length comes from the container duration and frame rate, without
+    the decoding pass of count_frames() (still used when the duration is
+    unknown). It may be a few frames too long : get() past the last frame
+    raises IndexError and shortens it.
+    '''
+    def __init__(self, path, cache_mb = 256, threads = 0, scale = 1.0):
         self.path = path
-        self.container = imageio.get_reader(path, 'ffmpeg')
-        self.length = self.container.count_frames()
-        self.fps = self.container.get_meta_data()['fps']
+        self.scale = scale
+        input_params = ['-threads', str(threads)] if threads else None
+        self.container = imageio.get_reader(path, 'ffmpeg', input_params = input_params)
+        meta = self.container.get_meta_data()
+        if scale != 1:
+            # imageio needs the output size up front, the first reader gave the source size
+            self.container.close()
+            size = scaled_size(meta['source_size'][0], meta['source_size'][1], scale)
+            self.container = imageio.get_reader(path, 'ffmpeg', input_params = input_params, size = size)
+        self.fps = meta['fps']
+        duration = meta.get('duration')
+        if duration and np.isfinite(duration):
+            self.length = int(round(duration * self.fps))
+        else:
+            self.length = self.container.count_frames()
+        self.cache = FrameCache(cache_mb)
+        self.decoded = 0
     
     def init_head(self):
         self.container.set_image_index(0)
@@ -28,7 +94,16 @@ class Video:
         self.container.get_next_data()
     
     def get(self, key):
-        return self.container.get_data(key)
+        frame = self.cache.get(key)
+        if frame is None:
+            try:
+                frame = self.container.get_data(key)
+            except IndexError:
+                self.length = min(self.length, key)
+                raise
+            self.decoded += 1
+            self.cache.put(key, frame)
+        return frame
     
     def __call__(self, key):
         return self.get(key)
@@ -37,16 +112,200 @@ class Video:
         return self.length
 
 
+## Face detectors
+
+class FaceDetector:
+    '''
+    Detector interface used by FaceFinder.
+    Locations are (top, right, bottom, left) tuples, as in face_recognition.
+    '''
+    def detect(self, image):
+        ''' Faces in a search patch around the last known location '''
+        raise NotImplementedError
+    
+    def detect_full_frame(self, image, upsample = 1):
+        ''' Faces anywhere in a frame, used when the patch search fails '''
+        return self.detect(image)
+    
+    def __repr__(self):
+        return type(self).__name__ + '()'
+
+
+class FaceRecognitionDetector(FaceDetector):
+    ''' dlib through face_recognition : CNN on patches, HOG on full frames (the original behaviour) '''
+    def __init__(self, model = 'cnn'):
+        if face_recognition is None:
+            raise ImportError("FaceRecognitionDetector needs face_recognition. Please install: pip install face_recognition")
+        self.model = model
+    
+    def detect(self, image):
+        return face_recognition.face_locations(image, model = self.model)
+    
+    def detect_full_frame(self, image, upsample = 1):
+        return face_recognition.face_locations(image, number_of_times_to_upsample = upsample)
+    
+    def __repr__(self):
+        return 'FaceRecognitionDetector({!r})'.format(self.model)
+
+
+class HaarDetector(FaceDetector):
+    '''
+    OpenCV Haar cascade. The cascade files ship with opencv-python, so it
+    works offline and runs in a few ms per frame on CPU.
+    '''
+    def __init__(self, cascade = 'haarcascade_frontalface_default.xml', scale_factor = 1.1, min_neighbors = 5, min_size = 40):
+        self.cascade_name = cascade
+        self.cascade = cv2.CascadeClassifier(join(cv2.data.haarcascades, cascade))
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+    
+    def detect(self, image, upsample = 1):
+        gray = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_RGB2GRAY)
+        min_size = max(int(self.min_size / upsample), 8)
+        rects = self.cascade.detectMultiScale(gray, scaleFactor = self.scale_factor,
+                                              minNeighbors = self.min_neighbors,
+                                              minSize = (min_size, min_size))
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in rects]
+    
+    def detect_full_frame(self, image, upsample = 1):
+        return self.detect(image, upsample)
+    
+    def __repr__(self):
+        return 'HaarDetector({!r}, {}, {}, {})'.format(self.cascade_name, self.scale_factor, self.min_neighbors, self.min_size)
+
+
+DETECTORS = {
+    'cnn': lambda: FaceRecognitionDetector('cnn'),
+    'hog': lambda: FaceRecognitionDetector('hog'),
+    'haar': HaarDetector,
+}
+
+
+def iou(a, b):
+    ''' Intersection over union of two (top, right, bottom, left) locations '''
+    h = min(a[2], b[2]) - max(a[0], b[0])
+    w = min(a[1], b[1]) - max(a[3], b[3])
+    inter = max(h, 0) * max(w, 0)
+    area = lambda l: (l[2] - l[0]) * (l[1] - l[3])
+    return inter / float(area(a) + area(b) - inter)
+
+
+class TemplateTracker:
+    '''
+    Follows a face between two detections by matching its last grayscale
+    patch around its last location. Returns None when the match is weak.
+    '''
+    def __init__(self, min_score = 0.6, margin = 0.3):
+        self.min_score = min_score
+        self.margin = margin
+        self.template = None
+    
+    def reset(self, frame, location):
+        y0, x1, y1, x0 = location
+        patch = frame[max(y0, 0):y1, max(x0, 0):x1]
+        self.template = cv2.cvtColor(np.ascontiguousarray(patch), cv2.COLOR_RGB2GRAY) if patch.size > 0 else None
+    
+    def track(self, frame, location):
+        if self.template is None:
+            return None
+        h, w = self.template.shape
+        offset = round(self.margin * max(h, w))
+        y0 = max(location[0] - offset, 0)
+        x0 = max(location[3] - offset, 0)
+        zone = frame[y0:location[2] + offset, x0:location[1] + offset]
+        if zone.shape[0] < h or zone.shape[1] < w:
+            return None
+        gray = cv2.cvtColor(np.ascontiguousarray(zone), cv2.COLOR_RGB2GRAY)
+        _, score, _, (dx, dy) = cv2.minMaxLoc(cv2.matchTemplate(gray, self.template, cv2.TM_CCOEFF_NORMED))
+        if score < self.min_score:
+            return None
+        new_location = (y0 + dy, x0 + dx + w, y0 + dy + h, x0 + dx)
+        self.template = gray[dy:dy + h, dx:dx + w]
+        return new_location
+
+
+## Face geometry
+
+# face_recognition landmark groups used for the alignment, fixed point counts
+LANDMARK_GROUPS = ('left_eye', 'right_eye', 'nose_tip', 'nose_bridge', 'top_lip', 'bottom_lip')
+
+
+def landmark_alignment(landmarks, K = 2.2):
+    '''
+    Face centre (row, col), side length and rotation (degrees) of many frames
+    at once, from a list of face_recognition landmark dicts.
+    We either choose K * distance(eyes, mouth),
+    or, if the head is tilted, K * distance(eye 1, eye 2)
+    /!\ landmarks coordinates are in (x,y) not (y,x)
+    Returns (centers (n, 2) int, lengths (n,) int, rotations (n,) float) arrays.
+    '''
+    # one (n, points, 2) array, then the (n, 2) centroid of each group
+    points = np.array([[p for g in LANDMARK_GROUPS for p in lm[g]] for lm in landmarks], dtype = np.float64)
+    bounds = np.cumsum([0] + [len(landmarks[0][g]) for g in LANDMARK_GROUPS])
+    E1, E2, NT, NB, B1, B2 = (points[:, a:b].mean(axis = 1) for a, b in zip(bounds[:-1], bounds[1:]))
+    E = (E1 + E2) / 2
+    N = NT / 2 + NB / 2
+    B = (B1 + B2) / 2
+
+    l1 = np.hypot(*(E1 - E2).T)
+    l2 = np.hypot(*(B - E).T)
+    lengths = np.floor(np.maximum(l1, l2) * K).astype(int)
+
+    dx, dy = (B - E).T
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        rotations = np.degrees(np.arctan(dx / dy))
+    rotations = np.where(dy == 0, np.where(dx > 0, 90.0, -90.0), rotations)
+
+    centers = np.floor(N[:, ::-1]).astype(int)
+    return centers, lengths, rotations
+
+
+def smooth_coordinates(coordinates, window = 5, max_gap = 5):
+    '''
+    Centred moving average of the face centre, size and rotation over `window`
+    consecutive entries of a {frame: (center, length, rotation)} dict,
+    removing the jitter of per-frame landmarks. Frames keep their own entry.
+    Only runs of nearby frames are smoothed : the average never crosses a gap
+    of more than max_gap frames (sparse framesets, missed detections, cuts).
+    '''
+    if window <= 1 or len(coordinates) < 2:
+        return dict(coordinates)
+    frames = np.array(sorted(coordinates))
+    values = np.array([(c[0], c[1], l, r) for c, l, r in (coordinates[i] for i in frames)], dtype = np.float64)
+    kernel = np.ones(window)
+    # centred sums, also for runs shorter than the window
+    centred = lambda v: np.convolve(v, kernel)[(window - 1) // 2:(window - 1) // 2 + len(v)]
+    smoothed = np.empty_like(values)
+    breaks = np.flatnonzero(np.diff(frames) > max_gap) + 1
+    for run in np.split(np.arange(len(frames)), breaks):
+        # divide by the number of entries actually in the window at both ends
+        counts = centred(np.ones(len(run)))
+        smoothed[run] = np.stack([centred(v) for v in values[run].T], axis = 1) / counts[:, None]
+    return {int(i): ((floor(y), floor(x)), floor(l), float(r)) for i, (y, x, l, r) in zip(frames, smoothed)}
+
+
 class FaceFinder(Video):
-    def __init__(self, path, load_first_face = True):
-        super().__init__(path)
+    '''
+    detector is a FaceDetector (or a DETECTORS key), FaceRecognitionDetector('cnn') by default.
+    threads and scale are those of Video.
+    '''
+    def __init__(self, path, load_first_face = True, cache_mb = 256, detector = None, threads = 0, scale = 1.0):
+        super().__init__(path, cache_mb, threads, scale)
+        if detector is None:
+            detector = FaceRecognitionDetector('cnn')
+        elif isinstance(detector, str):
+            detector = DETECTORS[detector]()
+        self.detector = detector
+        self.tracker = TemplateTracker()
         self.faces = {}
         self.coordinates = {}  # stores the face (locations center, rotation, length)
+        self._sha256 = None
         self.last_frame = self.get(0)
         self.frame_shape = self.last_frame.shape[:2]
         self.last_location = (0, 200, 200, 0)
         if (load_first_face):
-            face_positions = face_recognition.face_locations(self.last_frame, number_of_times_to_upsample=2)
+            face_positions = self.detector.detect_full_frame(self.last_frame, upsample = 2)
             if len(face_positions) > 0:
                 self.last_location = face_positions[0]
     
@@ -54,6 +313,58 @@ class FaceFinder(Video):
         np_coords = np.load(filename)
         self.coordinates = np_coords.item()
     
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = file_sha256(self.path)
+        return self._sha256
+    
+    def detection_cache_file(self, cache_dir, params):
+        ''' <video sha256>_<digest of the find_faces parameters>.npz '''
+        digest = hashlib.sha256(json.dumps(params, sort_keys = True).encode()).hexdigest()[:12]
+        return join(cache_dir, '{}_{}.npz'.format(self.sha256, digest))
+    
+    def save_detections(self, filename, params):
+        ''' Stores self.faces and self.coordinates as int/float arrays in a compressed npz '''
+        face_index = sorted(self.faces)
+        coord_index = sorted(self.coordinates)
+        np.savez_compressed(filename,
+                            params = json.dumps(params, sort_keys = True),
+                            face_index = np.array(face_index, dtype = np.int32),
+                            faces = np.array([self.faces[i] for i in face_index], dtype = np.int32).reshape(-1, 4),
+                            coord_index = np.array(coord_index, dtype = np.int32),
+                            coordinates = np.array([(c[0], c[1], l, r) for c, l, r in (self.coordinates[i] for i in coord_index)],
+                                                   dtype = np.float64).reshape(-1, 4))
+    
+    def load_detections(self, filename):
+        data = np.load(filename)
+        self.faces = {int(i): tuple(int(v) for v in loc)
+                      for i, loc in zip(data['face_index'], data['faces'])}
+        self.coordinates = {int(i): ((int(c[0]), int(c[1])), int(c[2]), float(c[3]))
+                            for i, c in zip(data['coord_index'], data['coordinates'])}
+    
+    def find_faces_cached(self, cache_dir, **kwargs):
+        '''
+        find_faces, with the results stored on disk under the SHA-256 of the video
+        and the detection parameters, so that re-analysing the same evidence
+        (for instance with another classifier) skips face detection.
+        '''
+        params = dict(kwargs, detector = repr(self.detector))
+        if self.scale != 1:
+            params['scale'] = self.scale  # locations of reduced frames
+        if face_recognition is None:
+            params['landmarks'] = False  # unrotated coordinates
+        if 'frameset' in params:
+            params['frameset'] = [int(i) for i in params['frameset']]
+        filename = self.detection_cache_file(cache_dir, params)
+        if isfile(filename):
+            self.load_detections(filename)
+            return 0
+        self.find_faces(**kwargs)
+        makedirs(cache_dir, exist_ok = True)
+        self.save_detections(filename, params)
+        return 0
+    
     def expand_location_zone(self, loc, margin = 0.2):
         ''' Adds a margin around a frame slice '''
         offset = round(margin * (loc[2] - loc[0]))
@@ -75,57 +386,55 @@ class FaceFinder(Video):
 
     @staticmethod
     def pop_largest_location(location_list):
-        max_location = location_list[0]
-        max_size = 0
-        if len(location_list) > 1:
-            for location in location_list:
-                size = location[2] - location[0]
-                if size > max_size:
-                    max_size = size
-                    max_location = location
-        return max_location
-    
-    @staticmethod
-    def L2(A, B):
-        return np.sqrt(np.sum(np.square(A - B)))
+        ''' Tallest of the (y0, x1, y1, x0) locations '''
+        heights = np.asarray(location_list)[:, 2] - np.asarray(location_list)[:, 0]
+        return location_list[int(np.argmax(heights))]
     
     def find_coordinates(self, landmark, K = 2.2):
-        '''
-        We either choose K * distance(eyes, mouth),
-        or, if the head is tilted, K * distance(eye 1, eye 2)
-        /!\ landmarks coordinates are in (x,y) not (y,x)
-        '''
-        E1 = np.mean(landmark['left_eye'], axis=0)
-        E2 = np.mean(landmark['right_eye'], axis=0)
-        E = (E1 + E2) / 2
-        N = np.mean(landmark['nose_tip'], axis=0) / 2 + np.mean(landmark['nose_bridge'], axis=0) / 2
-        B1 = np.mean(landmark['top_lip'], axis=0)
-        B2 = np.mean(landmark['bottom_lip'], axis=0)
-        B = (B1 + B2) / 2
-
-        C = N
-        l1 = self.L2(E1, E2)
-        l2 = self.L2(B, E)
-        l = max(l1, l2) * K
-        if (B[1] == E[1]):
-            if (B[0] > E[0]):
-                rot = 90
-            else:
-                rot = -90
-        else:
-            rot = np.arctan((B[0] - E[0]) / (B[1] - E[1])) / np.pi * 180
-        
-        return ((floor(C[1]), floor(C[0])), floor(l), rot)
+        ''' Face (center, length, rotation) of one landmark dict, see landmark_alignment '''
+        centers, lengths, rotations = landmark_alignment([landmark], K)
+        return (tuple(int(v) for v in centers[0]), int(lengths[0]), float(rotations[0]))
+    
+    def landmarks_to_coordinates(self, landmarks, K = 2.2):
+        ''' Fills self.coordinates from a {frame: landmark dict}, all frames at once '''
+        if not landmarks:
+            return
+        frames = list(landmarks)
+        centers, lengths, rotations = landmark_alignment([landmarks[i] for i in frames], K)
+        for i, c, l, r in zip(frames, centers.tolist(), lengths.tolist(), rotations.tolist()):
+            self.coordinates[i] = (tuple(c), l, r)
+    
+    @staticmethod
+    def face_landmarks(frame, location):
+        ''' face_recognition landmark dict of the face at location, None without face_recognition '''
+        if face_recognition is None:
+            return None
+        landmarks = face_recognition.face_landmarks(frame, [location])
+        # we assume that there is one and only one landmark group
+        return landmarks[0] if len(landmarks) > 0 else None
     
+    def locations_to_coordinates(self, locations):
+        ''' Unrotated coordinates of a {frame: location}, centred on the box with its height as length '''
+        for i, (y0, x1, y1, x0) in locations.items():
+            self.coordinates[i] = (((y0 + y1) // 2, (x0 + x1) // 2), y1 - y0, 0.0)
     
-    def find_faces(self, resize = 0.5, stop = 0, skipstep = 0, no_face_acceleration_threshold = 3, cut_left = 0, cut_right = -1, use_frameset = False, frameset = []):
+    def find_faces(self, resize = 0.5, stop = 0, skipstep = 0, no_face_acceleration_threshold = 3, cut_left = 0, cut_right = -1, use_frameset = False, frameset = [], detect_every = 1, smooth_window = 1):
         '''
         The core function to extract faces from frames
         using previous frame location and downsampling to accelerate the loop.
+        With detect_every = K > 1 the detector only runs every K frames and the
+        face is tracked by template matching in between (detection takes over
+        whenever tracking loses it).
+        Landmarks are turned into face coordinates for all the frames at once
+        after the loop, smoothed over smooth_window frames when > 1. Without
+        face_recognition the faces are not aligned : coordinates come from the
+        detected boxes, without rotation.
         '''
+        landmarks_found = {}
         not_found = 0
         no_face = 0
         no_face_acc = 0
+        since_detection = 0
         
         # to only deal with a subset of a video, for instance I-frames only
         if (use_frameset):
@@ -138,19 +447,39 @@ class FaceFinder(Video):
         
         # Quick face finder loop
         for i in finder_frameset:
-            # Get frame
-            frame = self.get(i)
+            # Get frame (the length from the metadata may overshoot the last one)
+            try:
+                frame = self.get(i)
+            except IndexError:
+                break
             if (cut_left != 0 or cut_right != -1):
+                frame = frame.copy()  # the cached frame is read-only
                 frame[:, :cut_left] = 0
                 frame[:, cut_right:] = 0            
             
+            # Between detections, follow the face found on the previous frames
+            if since_detection + 1 < detect_every:
+                face_location = self.tracker.track(frame, self.last_location)
+                if face_location is not None:
+                    since_detection += 1
+                    self.faces[i] = face_location
+                    self.last_location = face_location
+                    landmarks = self.face_landmarks(frame, face_location)
+                    if landmarks is not None:
+                        landmarks_found[i] = landmarks
+                    continue
+            since_detection = 0
+            
             # Find face in the previously found zone
             potential_location = self.expand_location_zone(self.last_location)
             potential_face_patch = frame[potential_location[0]:potential_location[2], potential_location[3]:potential_location[1]]
             potential_face_patch_origin = (potential_location[0], potential_location[3])
     
-            reduced_potential_face_patch = zoom(potential_face_patch, (resize, resize, 1))
-            reduced_face_locations = face_recognition.face_locations(reduced_potential_face_patch, model = 'cnn')
+            if potential_face_patch.size > 0:
+                reduced_potential_face_patch = cv2.resize(potential_face_patch, None, fx = resize, fy = resize, interpolation = cv2.INTER_AREA)
+                reduced_face_locations = self.detector.detect(reduced_potential_face_patch)
+            else:
+                reduced_face_locations = []
             
             if len(reduced_face_locations) > 0:
                 no_face_acc = 0  # reset the no_face_acceleration mode accumulator
@@ -161,22 +490,23 @@ class FaceFinder(Video):
                                                     1 / resize)
                 self.faces[i] = face_location
                 self.last_location = face_location
+                self.tracker.reset(frame, face_location)
                 
                 # extract face rotation, length and center from landmarks
-                landmarks = face_recognition.face_landmarks(frame, [face_location])
-                if len(landmarks) > 0:
-                    # we assume that there is one and only one landmark group
-                    self.coordinates[i] = self.find_coordinates(landmarks[0])
+                landmarks = self.face_landmarks(frame, face_location)
+                if landmarks is not None:
+                    landmarks_found[i] = landmarks
             else:
                 not_found += 1
 
-                if no_face_acc < no_face_acceleration_threshold:
+                reduced = no_face_acc >= no_face_acceleration_threshold
+                if not reduced:
                     # Look for face in full frame
-                    face_locations = face_recognition.face_locations(frame, number_of_times_to_upsample = 2)
+                    face_locations = self.detector.detect_full_frame(frame, upsample = 2)
                 else:
                     # Avoid spending to much time on a long scene without faces
-                    reduced_frame = zoom(frame, (resize, resize, 1))
-                    face_locations = face_recognition.face_locations(reduced_frame)
+                    reduced_frame = cv2.resize(frame, None, fx = resize, fy = resize, interpolation = cv2.INTER_AREA)
+                    face_locations = self.detector.detect_full_frame(reduced_frame)
                     
                 if len(face_locations) > 0:
                     print('Face extraction warning : ', i, '- found face in full frame', face_locations)
@@ -185,21 +515,31 @@ class FaceFinder(Video):
                     face_location = self.pop_largest_location(face_locations)
                     
                     # if was found on a reduced frame, upsample location
-                    if no_face_acc > no_face_acceleration_threshold:
+                    if reduced:
                         face_location = self.upsample_location(face_location, (0, 0), 1 / resize)
                     
                     self.faces[i] = face_location
                     self.last_location = face_location
+                    self.tracker.reset(frame, face_location)
                     
                     # extract face rotation, length and center from landmarks
-                    landmarks = face_recognition.face_landmarks(frame, [face_location])
-                    if len(landmarks) > 0:
-                        self.coordinates[i] = self.find_coordinates(landmarks[0])
+                    landmarks = self.face_landmarks(frame, face_location)
+                    if landmarks is not None:
+                        landmarks_found[i] = landmarks
                 else:
                     print('Face extraction warning : ',i, '- no face')
+                    self.tracker.template = None
                     no_face_acc += 1
                     no_face += 1
 
+        if face_recognition is None:
+            # no landmarks : crops centred on the detected boxes, not rotated
+            self.locations_to_coordinates(self.faces)
+        else:
+            self.landmarks_to_coordinates(landmarks_found)
+        if smooth_window > 1:
+            self.coordinates = smooth_coordinates(self.coordinates, smooth_window)
+
         print('Face extraction report of', 'not_found :', not_found)
         print('Face extraction report of', 'no_face :', no_face)
         return 0
@@ -222,27 +562,39 @@ class FaceFinder(Video):
         return padded_img[(padding + y0):(padding + y1),
                         (padding + x0):(padding + x1)]
     
-    def get_aligned_face(self, i, l_factor = 1.3):
+    @staticmethod
+    def alignment_matrix(c, l, r, size):
+        '''
+        Affine map from a size x size output to the frame : the square of side
+        l centred on c (row, col) rotated by r degrees. Same geometry as the
+        former pad + scipy rotate + crop path, in a single warp.
+        '''
+        scale = l / size  # frame pixels per output pixel
+        theta = np.deg2rad(r)
+        A = scale * np.array([[np.cos(theta), np.sin(theta)],
+                              [-np.sin(theta), np.cos(theta)]])
+        center = (size - 1) / 2
+        # pixel centres : the crop centre falls on c - 0.5 in frame coordinates
+        b = np.array([c[1] - 0.5, c[0] - 0.5]) - A.dot([center, center])
+        return np.hstack((A, b[:, None]))
+    
+    def get_aligned_face(self, i, l_factor = 1.3, size = None):
         '''
         The second core function that converts the data from self.coordinates into an face image.
+        Crop, rotation and scaling are one cv2.warpAffine (reflected borders), giving a
+        size x size face directly (the crop side in frame pixels by default).
         '''
         frame = self.get(i)
         if i in self.coordinates:
             c, l, r = self.coordinates[i]
             l = int(l) * l_factor # fine-tuning the face zoom we really want
-            dl_ = floor(np.sqrt(2) * l / 2) # largest zone even when rotated
-            patch = self.get_image_slice(frame,
-                                    floor(c[0] - dl_),
-                                    floor(c[0] + dl_),
-                                    floor(c[1] - dl_),
-                                    floor(c[1] + dl_))
-            rotated_patch = rotate(patch, -r, reshape=False)
-            # note : dl_ is the center of the patch of length 2dl_
-            return self.get_image_slice(rotated_patch,
-                                    floor(dl_-l//2),
-                                    floor(dl_+l//2),
-                                    floor(dl_-l//2),
-                                    floor(dl_+l//2))
+            side = 2 * int(l // 2)
+            if size is None:
+                size = side
+            M = self.alignment_matrix(c, side, r, size)
+            return cv2.warpAffine(frame, M, (size, size),
+                                  flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                  borderMode = cv2.BORDER_REFLECT_101)
         return frame
 
 
@@ -257,23 +609,28 @@ class FaceBatchGenerator:
         self.target_size = target_size
         self.head = 0
         self.length = int(face_finder.length)
+        self.buffer = None
 
     def resize_patch(self, patch):
-        m, n = patch.shape[:2]
-        return zoom(patch, (self.target_size / m, self.target_size / n, 1))
+        if patch.shape[:2] == (self.target_size, self.target_size):
+            return patch
+        return cv2.resize(patch, (self.target_size, self.target_size), interpolation = cv2.INTER_LINEAR)
     
     def next_batch(self, batch_size = 50):
-        batch = np.zeros((1, self.target_size, self.target_size, 3))
-        stop = min(self.head + batch_size, self.length)
+        '''
+        Returns the next faces as a float32 batch.
+        The batch is a view on a buffer that the next call overwrites.
+        '''
+        if self.buffer is None or len(self.buffer) < batch_size:
+            self.buffer = np.empty((batch_size, self.target_size, self.target_size, 3), dtype=np.float32)
         i = 0
         while (i < batch_size) and (self.head < self.length):
             if self.head in self.finder.coordinates:
-                patch = self.finder.get_aligned_face(self.head)
-                batch = np.concatenate((batch, np.expand_dims(self.resize_patch(patch), axis = 0)),
-                                        axis = 0)
+                patch = self.finder.get_aligned_face(self.head, size = self.target_size)
+                self.buffer[i] = self.resize_patch(patch)
                 i += 1
             self.head += 1
-        return batch[1:]
+        return self.buffer[:i]
 
 
 def predict_faces(generator, classifier, batch_size = 50, output_size = 1):
@@ -281,33 +638,52 @@ def predict_faces(generator, classifier, batch_size = 50, output_size = 1):
     Compute predictions for a face batch generator
     '''
     n = len(generator.finder.coordinates.items())
-    profile = np.zeros((1, output_size))
+    profile = []
     for epoch in range(n // batch_size + 1):
         face_batch = generator.next_batch(batch_size = batch_size)
         prediction = classifier.predict(face_batch)
         if (len(prediction) > 0):
-            profile = np.concatenate((profile, prediction))
-    return profile[1:]
+            profile.append(prediction)
+    if len(profile) == 0:
+        return np.zeros((0, output_size))
+    return np.concatenate(profile)
 
 
-def compute_accuracy(classifier, dirname, frame_subsample_count = 30):
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+
+
+def list_videos(dirname):
+    return sorted(f for f in listdir(dirname) if isfile(join(dirname, f)) and f[-4:] in VIDEO_EXTENSIONS)
+
+
+def predict_video(classifier, path, sampler, cache_dir = None, detector = None):
+    '''
+    Extraction + Prediction over a single video, returns the face predictions
+    '''
+    # Compute face locations and store them in the face finder
+    face_finder = FaceFinder(path, load_first_face = False, detector = detector)
+    frameset = sampler.indices(face_finder.length, path, face_finder.fps)
+    if cache_dir is not None:
+        face_finder.find_faces_cached(cache_dir, resize=0.5, use_frameset = True, frameset = frameset)
+    else:
+        face_finder.find_faces(resize=0.5, use_frameset = True, frameset = frameset)
+    
+    gen = FaceBatchGenerator(face_finder)
+    return predict_faces(gen, classifier)
+
+
+def compute_accuracy(classifier, dirname, frame_subsample_count = 30, sampler = None, cache_dir = None):
     '''
     Extraction + Prediction over a video
+    sampler picks the analysed frames, frame_subsample_count frames evenly spread by default
+    cache_dir keeps face detections between runs (see FaceFinder.find_faces_cached)
     '''
-    filenames = [f for f in listdir(dirname) if isfile(join(dirname, f)) and ((f[-4:] == '.mp4') or (f[-4:] == '.avi') or (f[-4:] == '.mov'))]
+    if sampler is None:
+        sampler = FrameSampler('uniform', count = frame_subsample_count)
     predictions = {}
     
-    for vid in filenames:
+    for vid in list_videos(dirname):
         print('Dealing with video ', vid)
-        
-        # Compute face locations and store them in the face finder
-        face_finder = FaceFinder(join(dirname, vid), load_first_face = False)
-        skipstep = max(floor(face_finder.length / frame_subsample_count), 0)
-        face_finder.find_faces(resize=0.5, skipstep = skipstep)
-        
-        print('Predicting ', vid)
-        gen = FaceBatchGenerator(face_finder)
-        p = predict_faces(gen, classifier)
-        
+        p = predict_video(classifier, join(dirname, vid), sampler, cache_dir)
         predictions[vid[:-4]] = (np.mean(p > 0.5), p)
-    return predictions
\ No newline at end of file
+    return predictions
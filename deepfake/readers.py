@@ -0,0 +1,151 @@
+# -*- coding:utf-8 -*-
+'''
+Video readers with the cv2.VideoCapture interface used by FrameSampler
+(get / set of the frame count, fps and position, grab, read, release).
+
+    cap = open_video(path, backend = 'opencv', threads = 0, scale = 1.0)
+
+backend :
+    'opencv' : cv2.VideoCapture with hardware decoding when the build and
+               the machine support it, and `threads` ffmpeg decoding threads
+    'pyav'   : PyAV (pip install av), frame and slice threaded decoding.
+               Frames are converted to BGR directly at the reduced size.
+scale < 1 gives frames at a reduced resolution. Both backends still decode
+full frames and scale them down afterwards, it saves memory and the work of
+the later stages rather than decoding time.
+The frame count comes from the container metadata, no decoding pass.
+'''
+
+import itertools
+
+import cv2
+
+BACKENDS = ('opencv', 'pyav')
+
+
+def scaled_size(width, height, scale):
+    ''' Even dimensions, as most pixel format conversions need '''
+    return max(2 * int(width * scale / 2), 2), max(2 * int(height * scale / 2), 2)
+
+
+def open_video(path, backend = 'opencv', threads = 0, scale = 1.0):
+    if backend == 'opencv':
+        return OpenCVReader(path, threads, scale)
+    if backend == 'pyav':
+        return PyAVReader(path, threads, scale)
+    raise ValueError('unknown video backend ' + backend)
+
+
+class OpenCVReader:
+    def __init__(self, path, threads = 0, scale = 1.0):
+        params = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        if threads:
+            params += [cv2.CAP_PROP_N_THREADS, threads]
+        self.cap = cv2.VideoCapture(path, cv2.CAP_ANY, params)
+        if not self.cap.isOpened():
+            # builds without the open parameters (or the accelerated decoder) refuse them
+            self.cap = cv2.VideoCapture(path)
+        self.scale = scale
+        self.size = scaled_size(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH), self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT), scale)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        if self.scale != 1 and prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            return self.size[0] if prop == cv2.CAP_PROP_FRAME_WIDTH else self.size[1]
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def grab(self):
+        return self.cap.grab()
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if ret and self.scale != 1:
+            frame = cv2.resize(frame, self.size, interpolation = cv2.INTER_AREA)
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class PyAVReader:
+    def __init__(self, path, threads = 0, scale = 1.0):
+        import av
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        if threads:
+            self.stream.codec_context.thread_count = threads
+        self.fps = float(self.stream.average_rate or self.stream.guessed_rate or 25)
+        self.start = self.stream.start_time or 0
+        if self.stream.frames:
+            self.length = self.stream.frames
+        elif self.stream.duration:
+            self.length = int(round(float(self.stream.duration * self.stream.time_base) * self.fps))
+        elif self.container.duration:
+            self.length = int(round(self.container.duration / av.time_base * self.fps))
+        else:
+            self.length = 0
+        self.width, self.height = self.stream.codec_context.width, self.stream.codec_context.height
+        self.size = scaled_size(self.width, self.height, scale) if scale != 1 else (self.width, self.height)
+        self.frames = self.container.decode(self.stream)
+        self.position = 0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def get(self, prop):
+        return {
+            cv2.CAP_PROP_FRAME_COUNT: self.length,
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_POS_FRAMES: self.position,
+            cv2.CAP_PROP_FRAME_WIDTH: self.size[0],
+            cv2.CAP_PROP_FRAME_HEIGHT: self.size[1],
+        }.get(prop, 0)
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.seek(int(value))
+        return True
+
+    def _next(self):
+        try:
+            frame = next(self.frames)
+        except StopIteration:
+            return None
+        self.position += 1
+        return frame
+
+    def grab(self):
+        return self._next() is not None
+
+    def read(self):
+        frame = self._next()
+        if frame is None:
+            return False, None
+        return True, frame.to_ndarray(width = self.size[0], height = self.size[1], format = 'bgr24')
+
+    def seek(self, index):
+        ''' To the keyframe before index, then decodes forward up to it '''
+        pts = self.start + int(index / self.fps / self.stream.time_base)
+        self.container.seek(pts, stream = self.stream, backward = True)
+        self.frames = self.container.decode(self.stream)
+        first = next(self.frames, None)
+        if first is None:
+            self.position = index
+            return
+        self.position = int(round(float((first.pts - self.start) * self.stream.time_base) * self.fps))
+        self.frames = itertools.chain([first], self.frames)
+        while self.position < index and self.grab():
+            pass
+
+    def release(self):
+        if self.opened:
+            self.container.close()
+            self.opened = False
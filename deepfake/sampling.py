@@ -0,0 +1,101 @@
+# -*- coding:utf-8 -*-
+
+import shutil
+import subprocess
+
+import numpy as np
+import cv2
+
+# Past this many frames between two samples, seeking is cheaper than grabbing
+SEEK_THRESHOLD = 250
+
+
+## Frame sampling
+
+def keyframe_indices(path, fps):
+    '''
+    Indices of the I-frames of a video, read from the packet flags with ffprobe
+    (no decoding). Returns None if ffprobe is not available.
+    '''
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+    out = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                          '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path],
+                         capture_output=True, text=True, check=True).stdout
+    times = []
+    for line in out.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            times.append(float(pts_time))
+    if not times:
+        return []
+    times = np.sort(times) - min(times)
+    return sorted(set(int(round(t * fps)) for t in times))
+
+
+class FrameSampler:
+    '''
+    Chooses the frames of a video to analyse and decodes only those.
+
+    strategy :
+        'every_nth' : one frame every `step` frames
+        'uniform'   : `count` frames spread evenly over the video
+        'keyframes' : I-frames only, every_nth if ffprobe is missing
+
+    Skipped frames are only grabbed (demuxed and decoded without the BGR
+    conversion and copy), long gaps are seeked over.
+    '''
+    STRATEGIES = ('every_nth', 'uniform', 'keyframes')
+
+    def __init__(self, strategy = 'every_nth', step = 10, count = 30, seek_threshold = SEEK_THRESHOLD):
+        if strategy not in self.STRATEGIES:
+            raise ValueError('unknown sampling strategy ' + strategy)
+        self.strategy = strategy
+        self.step = step
+        self.count = count
+        self.seek_threshold = seek_threshold
+
+    def indices(self, length, path = None, fps = 25):
+        ''' Sorted frame indices to analyse in a video of `length` frames '''
+        if self.strategy == 'uniform' and length > 0:
+            return np.unique(np.linspace(0, length - 1, min(self.count, length)).round().astype(int)).tolist()
+        if self.strategy == 'keyframes' and path is not None:
+            keyframes = keyframe_indices(path, fps)
+            if keyframes is not None:
+                return [i for i in keyframes if i < length] if length > 0 else keyframes
+            print('Frame sampling warning : ffprobe not found, using every', self.step, 'frames')
+        return list(range(0, length, self.step))
+
+    def frames(self, cap, path = None):
+        ''' Yields (index, frame) for the sampled frames of an opened cv2.VideoCapture (or readers.open_video reader) '''
+        length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.strategy == 'every_nth' or length <= 0:
+            # the container frame count is an estimate, read until the end
+            wanted = self._every_nth()
+        else:
+            wanted = self.indices(length, path, cap.get(cv2.CAP_PROP_FPS) or 25)
+
+        position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        for index in wanted:
+            if index - position > self.seek_threshold:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                position = index
+            while position < index:
+                if not cap.grab():
+                    return
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                return
+            position += 1
+            yield index, frame
+
+    def _every_nth(self):
+        index = 0
+        while True:
+            yield index
+            index += self.step
+
+    def __repr__(self):
+        return 'FrameSampler({!r}, step={}, count={})'.format(self.strategy, self.step, self.count)
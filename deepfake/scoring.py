@@ -0,0 +1,184 @@
+# -*- coding:utf-8 -*-
+
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from math import sqrt
+from statistics import NormalDist
+
+import numpy as np
+import cv2
+
+IMGWIDTH = 256
+
+
+## Batched inference
+
+# compiled predict functions, one per keras model
+_compiled = weakref.WeakKeyDictionary()
+
+# runs the models of an ensemble side by side (threads start on first use)
+ENSEMBLE_WORKERS = 4
+_ensemble_pool = ThreadPoolExecutor(max_workers = ENSEMBLE_WORKERS)
+
+
+def preprocess(frame, target_size = IMGWIDTH, out = None):
+    ''' Resizes a uint8 frame to target_size and scales it to [0, 1] float32 '''
+    if frame.shape[:2] != (target_size, target_size):
+        frame = cv2.resize(frame, (target_size, target_size))
+    if out is None:
+        out = np.empty((target_size, target_size, 3), dtype=np.float32)
+    np.multiply(frame, 1 / 255.0, out=out, casting='unsafe')
+    return out
+
+
+def compile_predict(model):
+    '''
+    Returns a function running the keras model on a float32 batch.
+    A tf.function with a fixed signature avoids the per call overhead of
+    model.predict and is traced once whatever the batch length.
+    '''
+    if model in _compiled:
+        return _compiled[model]
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return lambda x: model.predict(x, verbose=0)
+
+    signature = [tf.TensorSpec(shape=(None,) + tuple(model.input_shape[1:]), dtype=tf.float32)]
+    fn = tf.function(lambda x: model(x, training=False), input_signature=signature)
+    _compiled[model] = predict = lambda x: fn(x).numpy()
+    return predict
+
+
+def predict_function(classifier):
+    ''' Batch predict function of a keras classifier, or the predict method of a lite.LiteClassifier '''
+    model = getattr(classifier, 'model', None)
+    return compile_predict(model) if model is not None else classifier.predict
+
+
+class BatchPredictor:
+    '''
+    Accumulates preprocessed frames into a preallocated (batch_size, 256, 256, 3)
+    float32 buffer and runs the classifier on full batches.
+    '''
+    def __init__(self, classifier, batch_size = 32, target_size = IMGWIDTH):
+        self.classifier = classifier
+        self.batch_size = batch_size
+        self.target_size = target_size
+        self.buffer = np.empty((batch_size, target_size, target_size, 3), dtype=np.float32)
+        self.count = 0
+        self.scores = []
+        self.predict = self.make_predict(classifier)
+
+    def make_predict(self, classifier):
+        ''' Batch predict function used by predict_batch '''
+        return predict_function(classifier)
+
+    def add(self, frame):
+        ''' Resizes and normalises a frame into the next buffer slot, predicts once the buffer is full '''
+        preprocess(frame, self.target_size, out=self.buffer[self.count])
+        return self._added()
+
+    def add_preprocessed(self, x):
+        ''' Same as add for an already preprocessed (target_size, target_size, 3) array '''
+        self.buffer[self.count] = x
+        return self._added()
+
+    def _added(self):
+        self.count += 1
+        if self.count == self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        ''' Predicts the frames left in the buffer and returns their scores '''
+        if self.count == 0:
+            return []
+        scores = self.predict_batch(self.buffer[:self.count])
+        self.count = 0
+        self.scores.extend(scores)
+        return scores
+
+    def predict_batch(self, batch):
+        return self.predict(batch)[:, 0].tolist()
+
+
+class EnsemblePredictor(BatchPredictor):
+    '''
+    BatchPredictor feeding every batch to several classifiers, run side by
+    side in threads (TensorFlow and TFLite release the GIL while predicting).
+    classifiers : {name: classifier}. The scores are the weighted mean of the
+    models (equal weights by default), model_scores keeps those of each model.
+    '''
+    def __init__(self, classifiers, batch_size = 32, target_size = IMGWIDTH, weights = None):
+        super().__init__(classifiers, batch_size, target_size)
+        self.classifiers = classifiers
+        self.predicts = {name: predict_function(c) for name, c in classifiers.items()}
+        self.model_scores = {name: [] for name in classifiers}
+        weights = weights or {}
+        total = sum(weights.get(name, 1.0) for name in classifiers)
+        self.weights = {name: weights.get(name, 1.0) / total for name in classifiers}
+
+    def make_predict(self, classifiers):
+        return None  # one function per model, see predicts
+
+    def predict_batch(self, batch):
+        futures = {name: _ensemble_pool.submit(predict, batch) for name, predict in self.predicts.items()}
+        combined = np.zeros(len(batch))
+        for name, future in futures.items():
+            scores = future.result()[:, 0]
+            self.model_scores[name].extend(scores.tolist())
+            combined += self.weights[name] * scores
+        return combined.tolist()
+
+
+## Early stopping
+
+class SequentialTest:
+    '''
+    Sequential decision on the mean fake probability of a video.
+    After each batch of scores, the verdict is settled once the normal
+    confidence interval of the running mean no longer contains the threshold
+    (and at least min_frames were seen). Neighbouring sampled frames are
+    correlated, so min_frames keeps short confident streaks from deciding.
+    '''
+    def __init__(self, threshold = 0.5, confidence = 0.99, min_frames = 32):
+        self.threshold = threshold
+        self.confidence_level = confidence
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.min_frames = min_frames
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, scores):
+        ''' Adds scores (Welford running mean/variance), returns True once settled '''
+        for x in scores:
+            self.n += 1
+            delta = x - self.mean
+            self.mean += delta / self.n
+            self.m2 += delta * (x - self.mean)
+        return self.settled
+
+    @property
+    def stderr(self):
+        if self.n < 2:
+            return float('inf')
+        return sqrt(self.m2 / (self.n - 1) / self.n)
+
+    @property
+    def settled(self):
+        return self.n >= self.min_frames and abs(self.mean - self.threshold) > self.z * self.stderr
+
+    @property
+    def confidence(self):
+        ''' Two-sided confidence level at which the interval excludes the threshold '''
+        if self.n < 2:
+            return 0.0
+        if self.stderr == 0:
+            return 1.0 if self.mean != self.threshold else 0.0
+        return 2 * NormalDist().cdf(abs(self.mean - self.threshold) / self.stderr) - 1
+
+    def __repr__(self):
+        return 'SequentialTest(threshold={}, confidence={}, min_frames={})'.format(
+            self.threshold, self.confidence_level, self.min_frames)
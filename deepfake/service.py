@@ -0,0 +1,236 @@
+# -*- coding:utf-8 -*-
+'''
+Headless deepfake scoring service. The model is loaded once at start up and
+every request runs the sampling / inference pipeline on it.
+
+    python service.py [--port 8765 | --socket /tmp/deepfake.sock] [--weights weights/Meso4_DF.h5]
+
+POST /score
+    JSON body {"path": "/abs/path/video.mp4", "case_id": ..., "evidence_id": ...}
+    or the video itself as the body (Content-Type: application/octet-stream)
+    with the other fields in the query string :
+        POST /score?case_id=C1&evidence_id=E1&early_stop=1
+    Optional fields : strategy (every_nth, uniform, keyframes), step, count, early_stop,
+    mode (frames, face_tracks : score the tracked faces, see tracks.py).
+    With case_id and evidence_id the verdict is written to evidence_metadata,
+    on the row uploaded with the same file when its SHA-256 is known (computed
+    while an uploaded body is written, or given as "sha256" with a path).
+    Answers {"avg_probability", "prediction", "scores", "frames_used",
+    "stopped_early", "confidence", "evidence_updated", "sha256", "timings"},
+    and "cached" when started with --cache-dir.
+
+GET /health
+'''
+
+import argparse
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from hashing import save_stream
+
+WEIGHTS = 'weights/Meso4_DF.h5'
+
+
+class BadRequest(Exception):
+    def __init__(self, message, status = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def flag(value):
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+## Requests
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    server_version = 'DeepfakeScoring/1.0'
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/health':
+            self.send_json(200, {'status': 'ok', 'weights': self.server.weights})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/score':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                params = json.loads(self.read_body() or b'{}')
+                if not params.get('path'):
+                    raise BadRequest('path is required')
+                if not os.path.isfile(params['path']):
+                    raise BadRequest('video not found: ' + params['path'], 404)
+                result = self.server.score(params['path'], params)
+            else:
+                params = dict(parse_qsl(url.query))
+                result = self.score_upload(params)
+        except BadRequest as e:
+            self.send_json(e.status, {'error': str(e)})
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.log_error('scoring failed: %s', e)
+            self.send_json(500, {'error': str(e)})
+        else:
+            self.send_json(200, result)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def score_upload(self, params):
+        ''' Streams the request body to a temporary file, hashed on the way and deleted once scored '''
+        length = self.headers.get('Content-Length')
+        if length is None:
+            raise BadRequest('Content-Length is required', 411)
+        remaining = int(length)
+        if remaining == 0:
+            raise BadRequest('empty video')
+
+        start = time.perf_counter()
+        fd, path = tempfile.mkstemp(suffix = params.get('suffix', '.mp4'))
+        os.close(fd)
+        try:
+            try:
+                params['sha256'] = save_stream(self.rfile, path, remaining)
+            except EOFError as e:
+                raise BadRequest('upload cut short: ' + str(e))
+            upload = time.perf_counter() - start
+            result = self.server.score(path, params)
+            result['timings']['upload'] = round(upload, 3)
+            return result
+        finally:
+            os.unlink(path)
+
+
+## Servers
+
+class ScoringService:
+    '''
+    Holds the classifier shared by the request threads. At most `workers`
+    videos are analysed at once, other requests wait for a slot.
+    '''
+    def init_service(self, classifier, weights, workers, cache = None, frame_scores = False):
+        self.classifier = classifier
+        self.weights = weights
+        self.slots = threading.BoundedSemaphore(workers)
+        self.cache = cache
+        self.frame_scores = frame_scores
+
+    def score(self, path, params):
+        from engine import VideoAnalysisEngine
+        from sampling import FrameSampler
+        from scoring import SequentialTest
+        from verdicts import analyse_cached
+
+        sampler = FrameSampler(params.get('strategy', 'every_nth'),
+                               step = int(params.get('step', 10)), count = int(params.get('count', 30)))
+        if params.get('mode') == 'face_tracks':
+            from tracks import FaceTrackScorer
+            engine = FaceTrackScorer(self.classifier, sampler = sampler)
+        else:
+            engine = VideoAnalysisEngine(self.classifier, sampler = sampler)
+        early_stop = SequentialTest() if flag(params.get('early_stop', False)) else None
+
+        timings = {}
+        start = time.perf_counter()
+        with self.slots:
+            timings['queued'] = round(time.perf_counter() - start, 3)
+            start = time.perf_counter()
+            if self.cache is not None:
+                result = analyse_cached(engine, path, self.weights, self.cache,
+                                        video_hash = params.get('sha256'), early_stop = early_stop)
+            else:
+                result = engine.analyse(path, early_stop = early_stop)
+            timings['analysis'] = round(time.perf_counter() - start, 3)
+
+        result['evidence_updated'] = False
+        case_id, evidence_id = params.get('case_id'), params.get('evidence_id')
+        if case_id and evidence_id and result['scores']:
+            from evidence import update_result
+            start = time.perf_counter()
+            result['evidence_updated'] = update_result(
+                case_id, evidence_id, result['avg_probability'], result['prediction'], params.get('sha256'),
+                result['scores'] if self.frame_scores else None) > 0
+            timings['database'] = round(time.perf_counter() - start, 3)
+        result['sha256'] = params.get('sha256')
+        result['timings'] = timings
+        return result
+
+
+class TCPScoringServer(ScoringService, ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class UnixScoringServer(ScoringService, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(classifier, weights, workers = 2, host = '127.0.0.1', port = 8765, socket_path = None, cache = None,
+                frame_scores = False):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixScoringServer(socket_path, ScoringHandler)
+    else:
+        server = TCPScoringServer((host, port), ScoringHandler)
+    server.init_service(classifier, weights, workers, cache, frame_scores)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--socket', help = 'listen on this unix socket instead of TCP')
+    parser.add_argument('--classifier', default = 'Meso4', choices = ['Meso4', 'MesoInception4'])
+    parser.add_argument('--weights', default = WEIGHTS)
+    parser.add_argument('--workers', type = int, default = 2, help = 'videos analysed at once')
+    parser.add_argument('--cache-dir', help = 'keep verdicts between runs (see verdicts.py)')
+    parser.add_argument('--frame-scores', action = 'store_true', help = 'store the per-frame scores in evidence_metadata')
+    args = parser.parse_args()
+
+    from classifiers import load_classifier
+    classifier = load_classifier(args.classifier, args.weights)
+
+    cache = None
+    if args.cache_dir:
+        from verdicts import VerdictCache
+        cache = VerdictCache(args.cache_dir)
+
+    server = make_server(classifier, args.weights, args.workers, args.host, args.port, args.socket, cache,
+                         args.frame_scores)
+    print('Deepfake scoring service on', args.socket or '{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
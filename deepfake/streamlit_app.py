@@ -1,54 +1,22 @@
 import streamlit as st
-import cv2
-import numpy as np
-import psycopg2
 import tempfile
 import os
 import sys
-
-# ---------------- DB UPDATE FUNCTION ---------------- #
-
-def update_deepfake_result(case_id, evidence_id, avg_probability, prediction):
-    conn = psycopg2.connect(
-        host="localhost",
-        database="postgres",
-        user="postgres",
-        password="vvss",
-        port=5432
-    )
-    cur = conn.cursor()
-
-    cur.execute("""
-        UPDATE evidence_metadata
-        SET
-            avg_probability = %s,
-            prediction = %s,
-            deepfake_analyzed_at = NOW()
-        WHERE case_id = %s
-          AND evidence_id = %s
-    """, (
-        avg_probability,
-        prediction,
-        case_id,
-        evidence_id
-    ))
-
-    conn.commit()
-
-    if cur.rowcount == 0:
-        st.warning("⚠️ No matching evidence found. Please upload evidence first.")
-
-    cur.close()
-    conn.close()
-
-# --------------------------------------------------- #
+import glob
 
 # Add current directory to path for classifiers import
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Import model
 try:
-    from classifiers import Meso4
+    from engine import VideoAnalysisEngine
+    from sampling import FrameSampler
+    from scoring import SequentialTest
+    from lite import LiteClassifier, lite_path
+    from evidence import update_result
+    from hashing import save_stream
+    from verdicts import VerdictCache, analyse_cached
+    from tracks import FaceTrackScorer
 except ImportError as e:
     st.error(f"Could not import classifiers: {str(e)}")
     st.code("pip install -r requirements_simple.txt")
@@ -64,13 +32,28 @@ if not os.path.exists(weights_path):
     st.error(f"Weights file not found: {weights_path}")
     st.stop()
 
+# the TFLite export (python export.py) loads much faster when present
+model_path = lite_path(weights_path) if os.path.exists(lite_path(weights_path)) else weights_path
+
+# shared by every session : LiteClassifier serialises its predict calls
 @st.cache_resource
 def load_model():
-    model = Meso4()
-    model.load(weights_path)
-    return model
+    if model_path != weights_path:
+        return LiteClassifier(model_path)
+    # TensorFlow/Keras is only imported when there is no TFLite export
+    from classifiers import Meso4, load_classifier
+    return load_classifier(Meso4, weights_path)
+
+# the four shipped models, for the ensemble mode
+ensemble_paths = sorted(glob.glob("weights/*.h5"))
+
+@st.cache_resource
+def load_models():
+    from classifiers import load_ensemble
+    return load_ensemble(ensemble_paths)
 
 model = load_model()
+verdict_cache = VerdictCache()
 
 # ---------------- USER INPUTS ---------------- #
 
@@ -82,79 +65,93 @@ uploaded_video = st.file_uploader(
     type=["mp4", "avi", "mov"]
 )
 
+mode = st.radio(
+    "Analyse",
+    ["Whole frames", "Face tracks"],
+    help="Face tracks scores the faces found in the video, as the models were trained on"
+)
+early_stop = mode == "Whole frames" and st.checkbox("Stop as soon as the verdict is settled")
+use_ensemble = st.checkbox("Combine all the models (frames are decoded once for all of them)")
+
 # ---------------- VALIDATION ---------------- #
 
 if uploaded_video:
-    tfile = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-    tfile.write(uploaded_video.read())
-    tfile.close()
-
-    st.video(tfile.name)
+    st.video(uploaded_video)
 
 if not case_id or not evidence_id:
     st.warning("Please enter Case ID and Evidence ID")
 
 elif uploaded_video and st.button("Run Deepfake Detection"):
 
+    # Written in chunks, hashed on the way : the hash finds earlier results
+    # and the evidence row without reading the file again
+    fd, video_path = tempfile.mkstemp(suffix=os.path.splitext(uploaded_video.name)[1] or ".mp4")
+    os.close(fd)
+
     try:
-        cap = cv2.VideoCapture(tfile.name)
-        fake_scores = []
-        frame_count = 0
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        uploaded_video.seek(0)
+        video_hash = save_stream(uploaded_video, video_path)
 
         progress_bar = st.progress(0)
         status_text = st.empty()
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            if frame_count % 10 == 0:
-                frame_resized = cv2.resize(frame, (256, 256))
-                frame_normalized = frame_resized / 255.0
-                frame_input = np.expand_dims(frame_normalized, axis=0)
-
-                pred = model.model.predict(frame_input, verbose=0)[0][0]
-                fake_scores.append(pred)
-
-            frame_count += 1
-
+        def show_progress(frame_count, total_frames):
             if total_frames > 0:
                 progress_bar.progress(min(frame_count / total_frames, 1.0))
                 status_text.text(
                     f"Processing frame {frame_count} / {total_frames}"
                 )
 
-        cap.release()
+        # Predicted in batches, answered from the verdict cache when this
+        # video was analysed with the same model and settings before
+        classifier = load_models() if use_ensemble else model
+        if mode == "Face tracks":
+            # every 5th frame, faces detected every 5 sampled frames and tracked in between
+            engine = FaceTrackScorer(classifier, sampler=FrameSampler('every_nth', step=5))
+        else:
+            engine = VideoAnalysisEngine(classifier, sampler=FrameSampler('every_nth', step=10))
+        result = analyse_cached(
+            engine,
+            video_path,
+            ensemble_paths if use_ensemble else model_path,
+            verdict_cache,
+            video_hash=video_hash,
+            progress=show_progress,
+            early_stop=SequentialTest() if early_stop else None
+        )
+        avg_fake = result['avg_probability']
+        prediction = result['prediction']
+        if result['cached']:
+            st.info("This video was already analysed with this model, reusing its result")
 
         # ---------------- RESULT ---------------- #
 
-        if fake_scores:
-            avg_fake = float(sum(fake_scores) / len(fake_scores))
-            frames_used = len(fake_scores)
-
-            if avg_fake > 0.5:
-                prediction = "FAKE"
+        if result['scores']:
+            if prediction == "FAKE":
                 st.error("❌ FAKE VIDEO DETECTED")
             else:
-                prediction = "REAL"
                 st.success("✅ REAL VIDEO DETECTED")
 
             st.subheader("📊 Result")
             st.write(f"Average Fake Probability: **{avg_fake:.4f}**")
             st.write(f"Prediction: **{prediction}**")
-            st.write(f"Frames Analyzed: **{frames_used}**")
-
-            # 🔥 UPDATE SAME EVIDENCE ROW
-            update_deepfake_result(
-                case_id=case_id,
-                evidence_id=evidence_id,
-                avg_probability=avg_fake,
-                prediction=prediction
-            )
-
-            st.info("📁 Deepfake result updated in evidence record")
+            st.write(f"{'Faces' if 'tracks' in result else 'Frames'} Analyzed: **{result['frames_used']}**")
+            if result['stopped_early']:
+                st.write(f"Stopped early with **{result['confidence']:.1%}** confidence")
+            if 'tracks' in result:
+                st.write(f"Faces tracked: **{len(result['tracks'])}** (verdict of the most suspicious one)")
+            if 'models' in result:
+                st.table({
+                    "Model": list(result['models']),
+                    "Average Fake Probability": [m['avg_probability'] for m in result['models'].values()],
+                    "Prediction": [m['prediction'] for m in result['models'].values()],
+                })
+
+            # 🔥 UPDATE SAME EVIDENCE ROW (uploaded with the same file)
+            if update_result(case_id, evidence_id, avg_fake, prediction, file_hash=video_hash):
+                st.info("📁 Deepfake result updated in evidence record")
+            else:
+                st.warning("⚠️ No evidence with this Case ID, Evidence ID and video. Please upload evidence first.")
 
         else:
             st.warning("No frames were processed. Please try another video.")
@@ -163,7 +160,4 @@ elif uploaded_video and st.button("Run Deepfake Detection"):
         st.error(f"Error processing video: {str(e)}")
 
     finally:
-        try:
-            os.unlink(tfile.name)
-        except:
-            pass
+        os.unlink(video_path)
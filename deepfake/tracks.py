@@ -0,0 +1,190 @@
+# -*- coding:utf-8 -*-
+'''
+Face-track scoring : the models see the faces they were trained on instead
+of whole frames squeezed to 256x256.
+
+Faces are detected on a downscaled frame every few sampled frames and
+followed by template matching in between. Each track gets a 256x256 face
+crop per frame with the geometry of FaceFinder.get_aligned_face : centre,
+size and rotation come from the landmarks of the last detection frame and
+follow the tracked box in between. Without face_recognition (or before
+landmarks are found) the crops are centred on the box, without rotation.
+The crops of all the tracks are scored in shared batches, and the verdict
+is taken from the most suspicious track.
+'''
+
+from collections import deque
+
+import cv2
+
+from engine import summarise
+from pipeline import DETECTORS, FaceFinder, TemplateTracker, face_recognition, iou, landmark_alignment
+from readers import open_video
+from sampling import FrameSampler
+from scoring import IMGWIDTH, BatchPredictor, EnsemblePredictor
+
+
+class FaceTrack:
+    def __init__(self, track_id, frame, location):
+        self.id = track_id
+        self.location = location
+        self.tracker = TemplateTracker()
+        self.tracker.reset(frame, location)
+        self.misses = 0
+        self.frames = []
+        self.scores = []
+        # (centre offset from the box centre, length, rotation) from landmarks
+        self.alignment = None
+
+    def update(self, frame, location):
+        self.location = location
+        self.tracker.reset(frame, location)
+        self.misses = 0
+
+
+class FaceTrackScorer:
+    '''
+    Scores the face tracks of a video.
+
+    detector      : FaceDetector or DETECTORS key ('haar' by default : OpenCV only)
+    detect_every  : sampled frames between two detections, tracking in between
+    detect_scale  : detection runs on the frame resized by this factor
+    l_factor      : face crop side over the landmark face length (the box height without landmarks)
+    max_misses    : detections a track may miss before it is closed
+    min_frames    : tracks with fewer scored faces do not count for the verdict
+    reader        : readers.open_video options (backend, threads, scale)
+    '''
+    def __init__(self, classifier, sampler = None, detector = 'haar', detect_every = 5, detect_scale = 0.5,
+                 l_factor = 1.3, max_misses = 2, min_frames = 3, batch_size = 32, reader = None):
+        self.classifier = classifier
+        self.reader = reader or {}
+        self.sampler = sampler if sampler is not None else FrameSampler('every_nth', step = 5)
+        self.detector = DETECTORS[detector]() if isinstance(detector, str) else detector
+        self.detect_every = detect_every
+        self.detect_scale = detect_scale
+        self.l_factor = l_factor
+        self.max_misses = max_misses
+        self.min_frames = min_frames
+        self.batch_size = batch_size
+
+    def params(self):
+        ''' Settings changing the result, for the verdict cache '''
+        return {'mode': 'face_tracks', 'detector': repr(self.detector), 'detect_every': self.detect_every,
+                'detect_scale': self.detect_scale, 'l_factor': self.l_factor,
+                'max_misses': self.max_misses, 'min_frames': self.min_frames,
+                'aligned': face_recognition is not None}
+
+    def detect(self, frame):
+        reduced = cv2.resize(frame, None, fx = self.detect_scale, fy = self.detect_scale, interpolation = cv2.INTER_AREA)
+        return [FaceFinder.upsample_location(location, (0, 0), 1 / self.detect_scale)
+                for location in self.detector.detect_full_frame(reduced)]
+
+    def match(self, tracks, frame, locations, next_id):
+        ''' Greedy IoU matching of new detections to the open tracks, returns the tracks still open '''
+        unmatched = list(locations)
+        for track in tracks:
+            best = max(unmatched, key = lambda l: iou(l, track.location), default = None)
+            if best is not None and iou(best, track.location) > 0.3:
+                track.update(frame, best)
+                unmatched.remove(best)
+            else:
+                track.misses += 1
+        tracks = [t for t in tracks if t.misses <= self.max_misses]
+        for location in unmatched:
+            tracks.append(FaceTrack(next_id, frame, location))
+            next_id += 1
+        return tracks, next_id
+
+    def align(self, track, frame):
+        ''' Face geometry of a track from the landmarks of a detection frame, the previous one is kept if none are found '''
+        landmarks = FaceFinder.face_landmarks(frame, track.location)
+        if landmarks is None:
+            return
+        centers, lengths, rotations = landmark_alignment([landmarks])
+        y0, x1, y1, x0 = track.location
+        offset = (int(centers[0][0]) - (y0 + y1) // 2, int(centers[0][1]) - (x0 + x1) // 2)
+        track.alignment = (offset, int(lengths[0]), float(rotations[0]))
+
+    def face(self, frame, track):
+        ''' IMGWIDTH x IMGWIDTH face of the track, as FaceFinder.get_aligned_face (reflected borders) '''
+        y0, x1, y1, x0 = track.location
+        c = ((y0 + y1) // 2, (x0 + x1) // 2)
+        if track.alignment is None:
+            length, rotation = y1 - y0, 0
+        else:
+            offset, length, rotation = track.alignment
+            c = (c[0] + offset[0], c[1] + offset[1])
+        side = 2 * int(length * self.l_factor // 2)
+        M = FaceFinder.alignment_matrix(c, side, rotation, IMGWIDTH)
+        return cv2.warpAffine(frame, M, (IMGWIDTH, IMGWIDTH),
+                              flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                              borderMode = cv2.BORDER_REFLECT_101)
+
+    def analyse(self, path, progress = None, early_stop = None):
+        '''
+        Same summary as VideoAnalysisEngine.analyse, over the faces instead of
+        the frames ('scores' : every face in frame order), plus 'tracks' :
+        {track id: summary with the frame indices and last location}.
+        avg_probability and prediction are those of the highest scoring track.
+        classifier may be a {name: classifier} ensemble, as for the engine.
+        '''
+        if early_stop is not None:
+            raise ValueError('early stopping is not available for face tracks')
+        if isinstance(self.classifier, dict):
+            predictor = EnsemblePredictor(self.classifier, batch_size = self.batch_size)
+        else:
+            predictor = BatchPredictor(self.classifier, batch_size = self.batch_size)
+        pending = deque()  # track of each face waiting in the predictor buffer
+        closed, tracks, next_id = [], [], 0
+
+        def scored(scores):
+            for score in scores:
+                pending.popleft().scores.append(score)
+
+        cap = open_video(path, **self.reader)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        try:
+            for n, (index, frame) in enumerate(self.sampler.frames(cap, path)):
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # the models and detectors work on RGB
+                if n % self.detect_every == 0 or not tracks:
+                    before = tracks
+                    tracks, next_id = self.match(tracks, frame, self.detect(frame), next_id)
+                    closed += [t for t in before if t not in tracks]
+                    live = [t for t in tracks if t.misses == 0]
+                    for track in live:
+                        self.align(track, frame)
+                else:
+                    live = []
+                    for track in tracks:
+                        location = track.tracker.track(frame, track.location)
+                        if location is not None:
+                            track.location = location
+                            live.append(track)
+
+                for track in live:
+                    track.frames.append(index)
+                    pending.append(track)
+                    scored(predictor.add(self.face(frame, track)))
+                if progress is not None:
+                    progress(index + 1, total_frames)
+        finally:
+            cap.release()
+        scored(predictor.flush())
+
+        summaries = {}
+        for track in closed + tracks:
+            if track.scores:
+                summary = summarise(track.scores)
+                summary.update(frames = track.frames, location = list(track.location))
+                summaries[track.id] = summary
+        counted = [s for s in summaries.values() if s['frames_used'] >= self.min_frames] or list(summaries.values())
+        worst = max(counted, key = lambda s: s['avg_probability'], default = None)
+
+        result = summarise(predictor.scores)
+        if worst is not None:
+            result['avg_probability'], result['prediction'] = worst['avg_probability'], worst['prediction']
+        result['stopped_early'], result['confidence'] = False, None
+        result['tracks'] = summaries
+        if isinstance(predictor, EnsemblePredictor):
+            result['models'] = {name: summarise(scores) for name, scores in predictor.model_scores.items()}
+        return result
@@ -0,0 +1,137 @@
+# -*- coding:utf-8 -*-
+'''
+Cache of deepfake verdicts, so that a video analysed again with the same
+model and sampling is answered from disk.
+
+Entries are JSON files named <video sha256>_<weights sha256>_<parameters digest>.json :
+new weights never hit the entries of the old ones, which prune() removes.
+
+    python verdicts.py CACHE_DIR --prune weights/*.h5    # drop entries of other weights
+    python verdicts.py CACHE_DIR --clear
+'''
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+
+from hashing import file_sha256
+
+CACHE_DIR = 'cache/verdicts'
+
+# weights hashes by (path, size, mtime), the files are hashed once per process
+_weights_hashes = {}
+
+
+def weights_sha256(path):
+    '''
+    SHA-256 of a weights file, recomputed when the file changes.
+    For the list of weights files of an ensemble, digest of their hashes.
+    '''
+    if isinstance(path, (list, tuple)):
+        return hashlib.sha256(' '.join(weights_sha256(p) for p in path).encode()).hexdigest()
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _weights_hashes:
+        _weights_hashes[key] = file_sha256(path)
+    return _weights_hashes[key]
+
+
+class VerdictCache:
+    def __init__(self, cache_dir = CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def filename(self, video_hash, weights_hash, params):
+        digest = hashlib.sha256(json.dumps(params, sort_keys = True).encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, '{}_{}_{}.json'.format(video_hash, weights_hash[:16], digest))
+
+    def get(self, video_hash, weights_hash, params):
+        ''' Stored analysis result, or None '''
+        try:
+            with open(self.filename(video_hash, weights_hash, params)) as f:
+                return json.load(f)['result']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, video_hash, weights_hash, params, result):
+        os.makedirs(self.cache_dir, exist_ok = True)
+        filename = self.filename(video_hash, weights_hash, params)
+        entry = {'video_sha256': video_hash, 'weights_sha256': weights_hash, 'params': params,
+                 'created': time.time(), 'result': result}
+        # written aside then renamed, a reader never sees half an entry
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(entry, f)
+        os.replace(filename + '.tmp', filename)
+
+    def invalidate(self, video_hash = None, weights_hash = None):
+        ''' Removes the entries of a video and/or of weights (all entries by default), returns their number '''
+        pattern = '{}_{}_*.json'.format(video_hash or '*', weights_hash[:16] if weights_hash else '*')
+        files = glob.glob(os.path.join(self.cache_dir, pattern))
+        for filename in files:
+            os.remove(filename)
+        return len(files)
+
+    def prune(self, weights_paths):
+        ''' Removes the entries computed with weights other than weights_paths (alone or as an ensemble), returns their number '''
+        keep = {weights_sha256(path)[:16] for path in weights_paths}
+        keep.add(weights_sha256(list(weights_paths))[:16])
+        removed = 0
+        for filename in glob.glob(os.path.join(self.cache_dir, '*_*_*.json')):
+            if os.path.basename(filename).split('_')[1] not in keep:
+                os.remove(filename)
+                removed += 1
+        return removed
+
+
+def analysis_params(engine, early_stop = None):
+    ''' What, besides the video and the weights, changes the result of an analysis '''
+    params = {'sampler': repr(engine.sampler), 'early_stop': repr(early_stop) if early_stop is not None else None}
+    # the decoded pixels depend on the video reader, not on its thread count
+    reader = {k: v for k, v in getattr(engine, 'reader', {}).items() if k != 'threads'}
+    if reader:
+        params['reader'] = reader
+    # other scorers (tracks.FaceTrackScorer) add their own settings
+    if hasattr(engine, 'params'):
+        params.update(engine.params())
+    return params
+
+
+def analyse_cached(engine, path, weights_path, cache, video_hash = None, progress = None, early_stop = None):
+    '''
+    VideoAnalysisEngine.analyse through the cache. The result gets a 'cached'
+    flag. video_hash saves hashing the video when the caller already has it.
+    weights_path is the list of weights files for an ensemble engine.
+    '''
+    if video_hash is None:
+        video_hash = file_sha256(path)
+    weights_hash = weights_sha256(weights_path)
+    params = analysis_params(engine, early_stop)
+
+    result = cache.get(video_hash, weights_hash, params)
+    if result is not None:
+        result['cached'] = True
+        return result
+    result = engine.analyse(path, progress = progress, early_stop = early_stop)
+    if result['scores']:
+        cache.put(video_hash, weights_hash, params, result)
+    result['cached'] = False
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cache_dir', nargs = '?', default = CACHE_DIR)
+    group = parser.add_mutually_exclusive_group(required = True)
+    group.add_argument('--prune', nargs = '+', metavar = 'WEIGHTS', help = 'keep the entries of these weights only')
+    group.add_argument('--clear', action = 'store_true')
+    args = parser.parse_args()
+
+    cache = VerdictCache(args.cache_dir)
+    removed = cache.prune(args.prune) if args.prune else cache.invalidate()
+    print('Verdict cache :', removed, 'entries removed')
+
+
+if __name__ == '__main__':
+    main()
@@ -22,13 +22,14 @@ def generate_video_hash(file_path):
     return sha256.hexdigest()
 
 
-def insert(case_id, evidence_id, video_path):
+def insert(case_id, evidence_id, video_path, video_hash=None):
 
     if not os.path.exists(video_path):
         raise Exception("Video file not found")
 
-    # 1️⃣ Generate hash
-    video_hash = generate_video_hash(video_path)
+    # 1️⃣ Generate hash (unless the backend already hashed the upload)
+    if not video_hash:
+        video_hash = generate_video_hash(video_path)
     local_timestamp = datetime.now(timezone.utc).isoformat()
 
     print("========== EVIDENCE INGESTION ==========")
@@ -108,4 +109,5 @@ def insert(case_id, evidence_id, video_path):
 # -------- CLI SUPPORT (IMPORTANT) --------
 if __name__ == "__main__":
     import sys
-    insert(sys.argv[1], sys.argv[2], sys.argv[3])
\ No newline at end of file
+    # optional 4th argument : SHA-256 already computed by the backend
+    insert(*sys.argv[1:5])
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+Background jobs for update.py
+
+Slow work (contract deployment, encryption, IPFS upload) runs on a local
+thread pool. Each job has a row in the jobs table so its progress can be read
+back through /forenics/job/<id> from any worker process.
+"""
+
+import os
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import queries
+
+WORKERS = queries.JOB_CONNECTIONS
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="job")
+
+HOST = socket.gethostname()
+
+FIELDS = ("jid", "status", "stage", "filename", "caseid", "uid", "did", "error", "created", "updated")
+
+
+def owner():
+    """host:pid of this process, read at call time as gunicorn forks its workers after import"""
+    return "%s:%d" % (HOST, os.getpid())
+
+
+def create(filename, caseid, uid):
+    with queries.Database() as db:
+        jid = db.execute(queries.JOB_CREATE, (filename, caseid, uid, owner())).lastrowid
+        db.commit()
+    return jid
+
+
+def set_stage(jid, stage):
+    with queries.Database() as db:
+        db.execute(queries.JOB_STAGE, (stage, jid))
+        db.commit()
+
+
+def get(jid):
+    with queries.Database() as db:
+        row = db.fetchone(queries.JOB_GET, (jid,))
+    if row is None:
+        return None
+    return dict(zip(FIELDS, row))
+
+
+def submit(jid, func, *args):
+    """Runs func(jid, *args) in the pool, its return value is stored as the job did"""
+    return executor.submit(_run, jid, func, args)
+
+
+def _run(jid, func, args):
+    try:
+        did = func(jid, *args)
+        with queries.Database() as db:
+            db.execute(queries.JOB_DONE, (did, jid))
+            db.commit()
+    except Exception as e:
+        traceback.print_exc()
+        with queries.Database() as db:
+            db.execute(queries.JOB_FAILED, (str(e), jid))
+            db.commit()
+
+
+def _alive(pid):
+    # a job of our own pid predates this process: recovery runs before any
+    # job is created, and a restarted container often gets the same pid
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover():
+    """
+    Marks the unfinished jobs of processes of this host that are gone as
+    failed, returns their ids. Jobs of live workers and of other hosts are
+    left alone, so every worker can run it when it starts.
+    """
+    with queries.Database() as db:
+        rows = db.fetchall(queries.JOB_UNFINISHED, (HOST + ":%",))
+        dead = [jid for jid, job_owner in rows if not _alive(int(job_owner.rsplit(":", 1)[1]))]
+        for jid in dead:
+            db.execute(queries.JOB_INTERRUPTED, (jid,))
+        db.commit()
+    return dead
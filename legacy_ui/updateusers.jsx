@@ -8,9 +8,10 @@ const {state}=useLocation();
 const [uid, setuid] = useState(state[rx++]);
 const [name, setname] = useState(state[rx++]);
 const [email, setemail] = useState(state[rx++]);
-const [password, setpassword] = useState(state[rx++]);
 const [addresss, setaddresss] = useState(state[rx++]);
-const [keydata, setkeydata] = useState(state[rx++]);
+// viewusers does not send password/keydata, left empty they are kept as stored
+const [password, setpassword] = useState('');
+const [keydata, setkeydata] = useState('');
 const submitdata = () => {
  const value={uid:uid,name:name,email:email,password:password,addresss:addresss,keydata:keydata};
 axios.post("http://localhost:5000/forenics/updateusers", value).then
@@ -4,15 +4,24 @@ import { useState } from "react";
 import { useEffect } from "react";
 import {useNavigate } from "react-router-dom";
 
+const PAGE_SIZE = 100;
+
 const Viewtransactiondata = () => {
 const nav = useNavigate();
   const [data, setData] = useState([]);
   const [value, setvalue] = useState([]);
-    useEffect(() => {
-    axios.post("http://localhost:5000/forenics/viewtransactiondata").then((response) => {
-      setData(response.data);
-      setvalue(response.data);
+  const [more, setMore] = useState(false);
+  // the listing comes in pages of PAGE_SIZE rows, after the id of the last row loaded
+  const load = (after) => {
+    axios.post("http://localhost:5000/forenics/viewtransactiondata", { limit: PAGE_SIZE, after_id: after }).then((response) => {
+      const rows = value.concat(response.data);
+      setData(rows);
+      setvalue(rows);
+      setMore(response.data.length === PAGE_SIZE);
     });
+  };
+    useEffect(() => {
+    load(0);
   }, []);
   const viewtransactiondata = (e) => {
     nav("/updatetransactiondata", { state: e });
@@ -88,6 +97,13 @@ return (
             </tr>)})}</tbody>
           </table>
         </div>
+        {more && (
+            <button
+                className="btn btn-primary"
+                onClick={() => load(value[value.length - 1][0])}>
+                          Load more
+            </button>
+        )}
         </div>
         
 )
@@ -4,15 +4,24 @@ import { useState } from "react";
 import { useEffect } from "react";
 import {useNavigate } from "react-router-dom";
 
+const PAGE_SIZE = 100;
+
 const Viewusers = () => {
 const nav = useNavigate();
   const [data, setData] = useState([]);
   const [value, setvalue] = useState([]);
-    useEffect(() => {
-    axios.post("http://localhost:5000/forenics/viewusers").then((response) => {
-      setData(response.data);
-      setvalue(response.data);
+  const [more, setMore] = useState(false);
+  // the listing comes in pages of PAGE_SIZE rows, after the id of the last row loaded
+  const load = (after) => {
+    axios.post("http://localhost:5000/forenics/viewusers", { limit: PAGE_SIZE, after_id: after }).then((response) => {
+      const rows = value.concat(response.data);
+      setData(rows);
+      setvalue(rows);
+      setMore(response.data.length === PAGE_SIZE);
     });
+  };
+    useEffect(() => {
+    load(0);
   }, []);
   const viewusers = (e) => {
     nav("/updateusers", { state: e });
@@ -61,9 +70,7 @@ return (
 <th>uid</th>
 <th>name</th>
 <th>email</th>
-<th>password</th>
 <th>addresss</th>
-<th>keydata</th>
 </tr>
             </thead>
             <tbody>
@@ -77,7 +84,7 @@ return (
                           {d[0]}
                         </button>
                       </td>
-<td>{d[1]}</td><td>{d[2]}</td><td>{d[3]}</td><td>{d[4]}</td><td>{d[5]}</td><td>
+<td>{d[1]}</td><td>{d[2]}</td><td>{d[3]}</td><td>
             <button
                 className="btn btn-primary"
                 onClick={() => deletec(d[0])}>
@@ -87,6 +94,13 @@ return (
             </tr>)})}</tbody>
           </table>
         </div>
+        {more && (
+            <button
+                className="btn btn-primary"
+                onClick={() => load(value[value.length - 1][0])}>
+                          Load more
+            </button>
+        )}
         </div>
         
 )
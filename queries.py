@@ -0,0 +1,180 @@
+"""
+Database access for update.py
+
+Every statement is sent to MySQL as a server-side prepared statement and only
+executed with bound parameters. Connections come from a pool and each pooled
+connection keeps its prepared handles, so a statement is parsed once per
+connection instead of once per request.
+"""
+
+import threading
+import weakref
+
+import mysql.connector.pooling
+from mysql.connector.cursor import RE_SQL_INSERT_STMT
+
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",
+    "database": "forenics",
+}
+# request threads of the Flask server plus the jobs workers (jobs.WORKERS)
+REQUEST_CONNECTIONS = 12
+JOB_CONNECTIONS = 4
+POOL_SIZE = REQUEST_CONNECTIONS + JOB_CONNECTIONS
+# seconds a caller waits for a free pooled connection
+POOL_TIMEOUT = 10
+
+# ---------------- STATEMENTS ---------------- #
+
+LOGIN = "select * from users where uid=%s and password=%s"
+
+INSERT_DATA = "insert into data(filename,codeid,keyvalue,caseid)values (%s,%s,%s,%s)"
+# viewdata never returns the file key, an empty keyvalue keeps the stored one
+UPDATE_DATA = "update data set filename=%s,codeid=%s,keyvalue=coalesce(nullif(%s,''),keyvalue),caseid=%s where did=%s"
+DELETE_DATA = "delete from data where did=%s"
+
+# the space before values lets the connector batch it in Database.insertmany
+INSERT_TRANSACTIONDATA = "insert into transactiondata(trandata,uid,did,transcation,alltrans,trandate) values (%s,%s,%s,%s,%s,%s)"
+INSERT_UPLOAD_TRANSACTION = "insert into transactiondata(trandata,uid,did,alltrans)values (%s,%s,%s,%s)"
+UPDATE_TRANSACTIONDATA = "update transactiondata set trandata=%s,uid=%s,did=%s,transcation=%s,alltrans=%s,trandate=%s where td=%s"
+DELETE_TRANSACTIONDATA = "delete from transactiondata where td=%s"
+
+INSERT_USERS = "insert into users(name,email,password,addresss,keydata)values (%s,%s,%s,%s,%s)"
+# an empty password/keydata keeps the stored value (viewusers never returns them)
+UPDATE_USERS = "update users set name=%s,email=%s,password=coalesce(nullif(%s,''),password),addresss=%s,keydata=coalesce(nullif(%s,''),keydata) where uid=%s"
+DELETE_USERS = "delete from users where uid=%s"
+
+JOB_CREATE = "insert into jobs(status,stage,filename,caseid,uid,owner)values ('queued','queued',%s,%s,%s,%s)"
+JOB_STAGE = "update jobs set status='running',stage=%s where jid=%s"
+JOB_DONE = "update jobs set status='done',stage='done',did=%s where jid=%s"
+JOB_FAILED = "update jobs set status='failed',error=%s where jid=%s"
+JOB_GET = "select jid,status,stage,filename,caseid,uid,did,error,created,updated from jobs where jid=%s"
+# private keys only live in memory, jobs cut short by a restart cannot resume.
+# owner is host:pid of the process running the job, recovery only looks at its host
+JOB_UNFINISHED = "select jid,owner from jobs where status in ('queued','running') and owner like %s"
+JOB_INTERRUPTED = "update jobs set status='failed',error='interrupted by restart' where jid=%s and status in ('queued','running')"
+
+# listings, filters are appended by update.py before the order by clause
+VIEW_DATA = "select did,filename,codeid,caseid from data where did>%s"
+VIEW_TRANSACTIONDATA = "select td,trandata,uid,did,transcation,alltrans,trandate from transactiondata where td>%s"
+VIEW_USERS = "select uid,name,email,addresss from users where uid>%s"
+
+# -------------------------------------------- #
+
+_pool = None
+_pool_lock = threading.Lock()
+# the pool raises as soon as it is empty, callers wait on these slots instead
+_slots = threading.BoundedSemaphore(POOL_SIZE)
+
+# prepared cursors of each raw connection, keyed by statement text
+_prepared = weakref.WeakKeyDictionary()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # reset_session would deallocate the prepared statements every
+            # time a connection goes back to the pool
+            _pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name="forenics",
+                pool_size=POOL_SIZE,
+                pool_reset_session=False,
+                **DB_CONFIG
+            )
+        return _pool
+
+
+class Database:
+    """One pooled connection, use as a context manager or close() it"""
+
+    def __init__(self):
+        if not _slots.acquire(timeout=POOL_TIMEOUT):
+            raise mysql.connector.errors.PoolError("no free connection after %d s" % POOL_TIMEOUT)
+        try:
+            self.cnx = get_pool().get_connection()
+        except Exception:
+            _slots.release()
+            raise
+
+    def cursor(self, statement):
+        """Prepared cursor for statement, prepared on first use per connection"""
+        raw = self.cnx._cnx
+        handles = _prepared.get(raw)
+        # a reconnect drops every prepared statement on the server side
+        if handles is None or handles[0] != raw.connection_id:
+            handles = (raw.connection_id, {})
+            _prepared[raw] = handles
+        cursor = handles[1].get(statement)
+        if cursor is None:
+            cursor = self.cnx.cursor(prepared=True)
+            handles[1][statement] = cursor
+        return cursor
+
+    def execute(self, statement, params=()):
+        cursor = self.cursor(statement)
+        cursor.execute(statement, tuple(params))
+        return cursor
+
+    def insertmany(self, statement, rows):
+        """
+        Inserts many rows and returns their AUTO_INCREMENT ids. This goes
+        through a plain cursor: the connector rewrites the insert into one
+        multi-row insert, which a prepared statement would run row by row.
+
+        The ids are derived from LAST_INSERT_ID(), the id of the first row.
+        InnoDB reserves the ids of an insert whose row count is known up front
+        in one block, whatever innodb_autoinc_lock_mode, so they follow each
+        other auto_increment_increment apart. That only holds for a single
+        multi-row statement, hence the check that the connector batches it.
+        """
+        if not RE_SQL_INSERT_STMT.match(statement):
+            raise ValueError("insert not batched by the connector: " + statement)
+        rows = list(rows)
+        if not rows:
+            return []
+        cursor = self.cnx.cursor()
+        try:
+            cursor.executemany(statement, rows)
+            first, count = cursor.lastrowid, cursor.rowcount
+            cursor.execute("select @@session.auto_increment_increment")
+            step = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        assert count == len(rows), "expected %d inserted rows, got %d" % (len(rows), count)
+        return list(range(first, first + count * step, step))
+
+    def fetchall(self, statement, params=()):
+        return self.execute(statement, params).fetchall()
+
+    def fetchone(self, statement, params=()):
+        # fetchall so that no unread rows are left on the reused cursor
+        rows = self.fetchall(statement, params)
+        return rows[0] if rows else None
+
+    def commit(self):
+        self.cnx.commit()
+
+    def rollback(self):
+        self.cnx.rollback()
+
+    def close(self):
+        # ends the transaction left open by reads (and by errors): sessions are
+        # not reset by the pool, a pooled connection would otherwise keep its
+        # REPEATABLE READ snapshot and later requests would read stale rows
+        if self.cnx is None:
+            return
+        try:
+            self.rollback()
+        finally:
+            self.cnx.close()  # returns the connection to the pool
+            self.cnx = None
+            _slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()  # rolls back whatever was not committed
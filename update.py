@@ -1,4 +1,5 @@
-import mysql.connector
+import queries
+import jobs
 from flask_cors import CORS
 from flask import *
 app = Flask(__name__)
@@ -124,189 +125,224 @@ def soliditycontract(e):
     tx_receipt = "".join(["{:02X}".format(b) for b in tx_receipt["transactionHash"]])
     return tx_receipt
 
+# listing endpoints return at most PAGE_SIZE rows per call, callers page
+# through with after_id set to the id of the last row they received
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def page_args(r):
+    try:
+        limit = min(max(int(r.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        after_id = int(r.get('after_id', 0))
+    except (TypeError, ValueError):
+        abort(Response(json.dumps({'error': 'limit and after_id must be integers'}), 400, mimetype='application/json'))
+    return limit, after_id
+
+def stream_rows(db, tx, params):
+    ''' Runs a select and streams the rows back as a json array of rows '''
+    try:
+        mycursor = db.execute(tx, params)
+    except Exception:
+        db.close()
+        raise
+    finished = []
+    def generate():
+        yield '['
+        sep = ''
+        for row in mycursor:
+            yield sep + json.dumps(row, default=str)
+            sep = ','
+        yield ']'
+        finished.append(True)
+    def release():
+        # called when the response is closed, even if it was never iterated
+        try:
+            if not finished:
+                # client went away, leave no unread rows on the pooled connection
+                mycursor.fetchall()
+        finally:
+            db.close()
+    response = Response(generate(), mimetype='application/json')
+    response.call_on_close(release)
+    return response
+
     
 @app.route('/forenics/updatedata', methods=["POST"], strict_slashes=False)
 def updatedata():
     r=request.json
-    mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-    d="update data set filename ='%s',codeid ='%s',keyvalue ='%s',caseid ='%s' where did='%s'"%(r['filename'],r['codeid'],r['keyvalue'],r['caseid'],r['did'])
-    mycursor = mydb.cursor()
-    mycursor.execute(d)
-    mydb.commit()
-    mydb.close()
+    with queries.Database() as db:
+        db.execute(queries.UPDATE_DATA, (r['filename'],r['codeid'],r.get('keyvalue',''),r['caseid'],r['did']))
+        db.commit()
     return 's'
     
 @app.route('/forenics/viewdata', methods=["POST"], strict_slashes=False)
 def viewdata():
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx="select *   from data"
-        mycursor.execute(tx)
-        e=mycursor.fetchall()
-        mydb.close()
-        return json.dumps(e)
+        r=request.get_json(silent=True) or {}
+        limit, after_id = page_args(r)
+        # keyvalue is the file encryption key, it is never listed
+        tx=queries.VIEW_DATA
+        params=[after_id]
+        if r.get('caseid'):
+                tx+=" and caseid=%s"
+                params.append(r['caseid'])
+        tx+=" order by did limit %s"
+        params.append(limit)
+        return stream_rows(queries.Database(), tx, params)
 @app.route('/forenics/deletedata', methods=["POST"], strict_slashes=False)
 def deletedata():
         r=request.json
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx="delete from data where did={0}".format(r['id'])
-        mycursor.execute(tx)
-        mydb.commit()
-        mydb.close()
+        with queries.Database() as db:
+                db.execute(queries.DELETE_DATA, (r['id'],))
+                db.commit()
+        return 's'
 @app.route('/forenics/inserttransactiondata', methods=["POST"], strict_slashes=False)
 def inserttransactiondata():
     r=request.json
-    mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-    mycursor = mydb.cursor()
-    tx = 'select td from transactiondata order by td desc limit 1'
-    mycursor.execute(tx)
-    e = mycursor.fetchall()
-    if len(e) == 0:
-            eid = 1
-    else:
-            eid = e[0][0]+1
-    d="insert into transactiondata(td,trandata,uid,did,transcation,alltrans,trandate)values ('%s','%s','%s','%s','%s','%s','%s')"%(eid,r['trandata'],r['uid'],r['did'],r['transcation'],r['alltrans'],r['trandate'])
-    mycursor = mydb.cursor()
-    mycursor.execute(d)
-    mydb.commit()
-    mydb.close()
-    return 'e'
+    with queries.Database() as db:
+        # td is AUTO_INCREMENT, the id is assigned by the insert itself
+        mycursor = db.execute(queries.INSERT_TRANSACTIONDATA, (r['trandata'],r['uid'],r['did'],r['transcation'],r['alltrans'],r['trandate']))
+        eid = mycursor.lastrowid
+        db.commit()
+    return json.dumps(eid)
+    
+# rows per multi-row insert in inserttransactiondata_bulk
+BULK_BATCH_SIZE = 500
+
+@app.route('/forenics/inserttransactiondata/bulk', methods=["POST"], strict_slashes=False)
+def inserttransactiondata_bulk():
+    r=request.json
+    if not isinstance(r, list):
+        return json.dumps({'error': 'expected a list of transaction records'}), 400
+    rows=[(t['trandata'],t['uid'],t['did'],t['transcation'],t['alltrans'],t['trandate']) for t in r]
+    ids=[]
+    with queries.Database() as db:
+        # one transaction for the whole import, one multi-row insert per batch
+        for i in range(0, len(rows), BULK_BATCH_SIZE):
+            ids.extend(db.insertmany(queries.INSERT_TRANSACTIONDATA, rows[i:i+BULK_BATCH_SIZE]))
+        db.commit()
+    return json.dumps(ids)
     
 @app.route('/forenics/updatetransactiondata', methods=["POST"], strict_slashes=False)
 def updatetransactiondata():
     r=request.json
-    mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-    d="update transactiondata set trandata ='%s',uid ='%s',did ='%s',transcation ='%s',alltrans ='%s',trandate ='%s' where td='%s'"%(r['trandata'],r['uid'],r['did'],r['transcation'],r['alltrans'],r['trandate'],r['td'])
-    mycursor = mydb.cursor()
-    mycursor.execute(d)
-    mydb.commit()
-    mydb.close()
+    with queries.Database() as db:
+        db.execute(queries.UPDATE_TRANSACTIONDATA, (r['trandata'],r['uid'],r['did'],r['transcation'],r['alltrans'],r['trandate'],r['td']))
+        db.commit()
     return 's'
     
 @app.route('/forenics/viewtransactiondata', methods=["POST"], strict_slashes=False)
 def viewtransactiondata():
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx="select *   from transactiondata"
-        mycursor.execute(tx)
-        e=mycursor.fetchall()
-        mydb.close()
-        return json.dumps(e)
+        r=request.get_json(silent=True) or {}
+        limit, after_id = page_args(r)
+        tx=queries.VIEW_TRANSACTIONDATA
+        params=[after_id]
+        for col in ('uid', 'did'):
+                if r.get(col):
+                        tx+=" and %s=%%s"%col
+                        params.append(r[col])
+        if r.get('date_from'):
+                tx+=" and trandate>=%s"
+                params.append(r['date_from'])
+        if r.get('date_to'):
+                tx+=" and trandate<%s"
+                params.append(r['date_to'])
+        tx+=" order by td limit %s"
+        params.append(limit)
+        return stream_rows(queries.Database(), tx, params)
 @app.route('/forenics/deletetransactiondata', methods=["POST"], strict_slashes=False)
 def deletetransactiondata():
         r=request.json
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx="delete from transactiondata where td={0}".format(r['id'])
-        mycursor.execute(tx)
-        mydb.commit()
-        mydb.close()
+        with queries.Database() as db:
+                db.execute(queries.DELETE_TRANSACTIONDATA, (r['id'],))
+                db.commit()
         return 's'
 @app.route('/forenics/insertusers', methods=["POST"], strict_slashes=False)
 def insertusers():
     r=request.json
-    mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-    mycursor = mydb.cursor()
-    tx = 'select uid from users order by uid desc limit 1'
-    mycursor.execute(tx)
-    e = mycursor.fetchall()
-    if len(e) == 0:
-            eid = 1
-    else:
-            eid = e[0][0]+1
-    d="insert into users(uid,name,email,password,addresss,keydata)values ('%s','%s','%s','%s','%s','%s')"%(eid,r['name'],r['email'],r['password'],r['addresss'],r['keydata'])
-    mycursor = mydb.cursor()
-    mycursor.execute(d)
-    mydb.commit()
-    mydb.close()
-    return 'e'
+    with queries.Database() as db:
+        # uid is AUTO_INCREMENT, the id is assigned by the insert itself
+        mycursor = db.execute(queries.INSERT_USERS, (r['name'],r['email'],r['password'],r['addresss'],r['keydata']))
+        eid = mycursor.lastrowid
+        db.commit()
+    return json.dumps(eid)
     
 @app.route('/forenics/updateusers', methods=["POST"], strict_slashes=False)
 def updateusers():
     r=request.json
-    mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-    d="update users set name ='%s',email ='%s',password ='%s',addresss ='%s',keydata ='%s' where uid='%s'"%(r['name'],r['email'],r['password'],r['addresss'],r['keydata'],r['uid'])
-    mycursor = mydb.cursor()
-    mycursor.execute(d)
-    mydb.commit()
-    mydb.close()
+    with queries.Database() as db:
+        db.execute(queries.UPDATE_USERS, (r['name'],r['email'],r.get('password',''),r['addresss'],r.get('keydata',''),r['uid']))
+        db.commit()
     return 's'
     
 @app.route('/forenics/viewusers', methods=["POST"], strict_slashes=False)
 def viewusers():
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx="select *   from users"
-        mycursor.execute(tx)
-        e=mycursor.fetchall()
-        mydb.close()
-        return json.dumps(e)
+        r=request.get_json(silent=True) or {}
+        limit, after_id = page_args(r)
+        # password and keydata are never listed
+        tx=queries.VIEW_USERS+" order by uid limit %s"
+        return stream_rows(queries.Database(), tx, [after_id, limit])
 @app.route('/forenics/deleteusers', methods=["POST"], strict_slashes=False)
 def deleteusers():
         r=request.json
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx="delete from users where uid={0}".format(r['id'])
-        mycursor.execute(tx)
-        mydb.commit()
-        mydb.close()
+        with queries.Database() as db:
+                db.execute(queries.DELETE_USERS, (r['id'],))
+                db.commit()
         return 's'
 
+def process_upload(jid, filename, caseid, uid, address, private):
+    ''' The slow part of an upload, run by a jobs worker. Returns the new did '''
+    jobs.set_stage(jid, 'contract')
+    ha=soliditycontract([address,private])
+    jobs.set_stage(jid, 'encrypt')
+    key = get_random_bytes(8)
+    received=encrypt_file(filename,"en"+filename, key)
+    print(filename,caseid,key,"en"+filename,received)
+    jobs.set_stage(jid, 'store')
+    with queries.Database() as db:
+        # did and td are AUTO_INCREMENT: both rows go through the same
+        # connection and are committed together, lastrowid links them
+        mycursor = db.execute(queries.INSERT_DATA, (filename,received,str(key),caseid))
+        eid = mycursor.lastrowid
+        db.execute(queries.INSERT_UPLOAD_TRANSACTION, (ha,uid,eid,'insert'))
+        db.commit()
+    return eid
+
 @app.route('/forenics/upload', methods = ['POST'])  
 def success():  
     if request.method == 'POST':  
         f = request.files['file']
         caseid=request.form["caseid"]
-        key = get_random_bytes(8)
         address=request.form["address"]
         private=request.form["private"]
         
         uid=request.form["uid"]
-        ha=soliditycontract([address,private])
         
         f.save("static/upload/"+f.filename)  
-        received=encrypt_file(f.filename,"en"+f.filename, key)
-        print(f,caseid,key,"en"+f.filename,received)
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx = 'select did from data order by did desc limit 1'
-        mycursor.execute(tx)
-        e = mycursor.fetchall()
-        if len(e) == 0:
-                eid = 1
-        else:
-                eid = e[0][0]+1
-        d="""insert into data(did,filename,codeid,keyvalue,caseid)values ("%s","%s","%s","%s","%s")"""%(eid,f.filename,received,key,caseid)
-        mycursor = mydb.cursor()
-        mycursor.execute(d)
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx = 'select td from transactiondata order by td desc limit 1'
-        mycursor.execute(tx)
-        e = mycursor.fetchall()
-        if len(e) == 0:
-                did = 1
-        else:
-                did = e[0][0]+1
-        d="insert into transactiondata(td,trandata,uid,did,alltrans)values ('%s','%s','%s','%s','%s')"%(did,ha,uid,eid,'insert')
-        mycursor = mydb.cursor()
-        mycursor.execute(d)
-        mydb.commit()
-        mydb.close()
-        return 'e'
+        # contract, encryption and IPFS run in the background, poll /forenics/job/<id>
+        jid = jobs.create(f.filename, caseid, uid)
+        jobs.submit(jid, process_upload, f.filename, caseid, uid, address, private)
+        return json.dumps({'job': jid, 'status': 'queued'})
+
+@app.route('/forenics/job/<int:jid>', methods=["GET", "POST"], strict_slashes=False)
+def job(jid):
+        e=jobs.get(jid)
+        if e is None:
+                return json.dumps({'error': 'unknown job'}), 404
+        return json.dumps(e, default=str)
     
 
 @app.route('/forenics/login', methods=["POST"], strict_slashes=False)
 def login():
         r=request.json
-        mydb = mysql.connector.connect(host="localhost", user="root",  password="",  database="forenics")
-        mycursor = mydb.cursor()
-        tx="select *   from users where uid='%s' and password='%s'"%(r["id"],r["password"])
-        mycursor.execute(tx)
-        e=mycursor.fetchone()
-        mydb.close()
+        with queries.Database() as db:
+                e=db.fetchone(queries.LOGIN, (r["id"],r["password"]))
         return json.dumps(e)
     
+# runs in every process serving the app (flask run, gunicorn workers, app.run)
+try:
+    jobs.recover()
+except Exception as e:
+    print(f"Job recovery failed: {e}")
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file